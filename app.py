@@ -3,11 +3,30 @@ FunPay Analytics — Flask сервер
 Запуск: python app.py
 Открыть: http://localhost:5000
 """
-from flask import Flask, jsonify, render_template_string, request
+from flask import Flask, Response, g, jsonify, render_template_string, request, stream_with_context
+import os
+import json
+import math
+import signal
+import sys
 import threading
 import time
 import logging
-from parser import analyze_category, get_categories, analyze_seller
+from contextlib import nullcontext
+from functools import partial
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from parser import (analyze_category, get_categories, analyze_seller, crawl_lot_details, enrich_top_sellers,
+                    sort_months, MAX_CONCURRENT_FETCHES)
+import history
+import metrics
+import profiling
+import rates
+import scheduler
+import search
+import urls
+import warmcache
+import watchlist
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s %(message)s")
@@ -15,9 +34,21 @@ logger = logging.getLogger("FunPayAnalyst")
 
 app = Flask(__name__)
 
-# Кэш результатов (ключ = url_currency)
+# Кэш результатов (ключ = urls.Key: вид цели, id, валюта)
+CACHE_TTL = 300
+MAX_BUDGET = 300  # верхняя граница бюджета времени одного анализа, секунды
+MAX_ENRICH = 20   # столько продавцов в top_sellers, больше обогащать нечего
+MAX_DETAILS = 200  # страниц лотов за один запрос с details
+# Заголовок с идентификатором клиента от доверенного прокси (например X-Forwarded-For);
+# без него клиент — IP соединения
+CLIENT_HEADER = os.environ.get("FUNPAY_CLIENT_HEADER", "")
+# HTTP-статус ответа, когда анализ не удался из-за FunPay (поле reason результата)
+_REASON_STATUS = {"not_found": 404, "blocked": 503, "deadline": 504,
+                  "server_error": 502, "network": 502, "client_error": 502, "parse_error": 502}
 _cache: dict = {}
 _cache_lock = threading.Lock()
+# Анализы в процессе (ключ тот же): повторный запрос ждёт уже идущий скрейп
+_inflight: dict = {}
 
 DASHBOARD_HTML = r"""<!DOCTYPE html>
 <html lang="ru">
@@ -1178,11 +1209,265 @@ document.addEventListener('DOMContentLoaded', () => {
 </html>"""
 
 
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "started" in g:
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/")
 def index():
     return render_template_string(DASHBOARD_HTML)
 
 
+def _cache_get(cache_key: urls.Key):
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached and time.time() - cached["ts"] < CACHE_TTL:
+            metrics.CACHE_REQUESTS.inc(result="hit")
+            return cached["data"]
+    # После перезапуска запись может ждать в снимке кэша — распаковываем при первом обращении
+    restored = warmcache.get(cache_key, CACHE_TTL)
+    if restored is not None:
+        with _cache_lock:
+            _cache.setdefault(cache_key, restored)
+        metrics.CACHE_REQUESTS.inc(result="warm")
+        return restored["data"]
+    metrics.CACHE_REQUESTS.inc(result="miss")
+    return None
+
+
+def _cache_fresh(cache_key: urls.Key, exact: bool = False) -> bool:
+    """Есть ли в кэше (или в снимке после перезапуска) свежий результат; метрики кэша не трогает."""
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached is not None and time.time() - cached["ts"] < CACHE_TTL:
+            return not (exact and "converted" in cached["data"])
+    # Запись снимка не распаковываем: exact по ней не проверить, такой запрос просто встанет в очередь
+    return not exact and warmcache.contains(cache_key, CACHE_TTL)
+
+
+def _client_id() -> str:
+    """Клиент для квот и справедливой очереди скрейпов."""
+    if CLIENT_HEADER and request.headers.get(CLIENT_HEADER):
+        return request.headers[CLIENT_HEADER].split(",")[0].strip()
+    return request.remote_addr or "unknown"
+
+
+def _job_cost(target: urls.Target, max_reviews: int, enrich: int = 0, details: int = 0) -> float:
+    """Примерная стоимость анализа в страницах FunPay."""
+    if target.is_category:
+        cost = 2  # max_pages обхода категории
+    else:
+        cost = 1 + math.ceil(max_reviews / 25)  # профиль + страницы отзывов
+        if target.is_offer:
+            cost += 1
+    return cost + enrich + details
+
+
+def _rejected(e: scheduler.Rejected):
+    message = ("Слишком много запросов, попробуйте позже" if e.reason == "quota"
+               else "Слишком много анализов в очереди, дождитесь завершения")
+    return (jsonify({"error": message, "reason": e.reason}), 429,
+            {"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+
+def _cache_snapshot() -> None:
+    """Сохраняет кэш анализов на диск для тёплого перезапуска."""
+    with _cache_lock:
+        entries = dict(_cache)
+    warmcache.save(entries, CACHE_TTL)
+
+
+def run_analysis(url: str, currency: str, max_reviews: int = 200, budget: Optional[float] = None) -> dict:
+    """
+    Анализирует категорию или продавца и кладёт результат в кэш и историю.
+    Одновременные вызовы с одним ключом выполняют один скрейп (single-flight).
+    С budget (секунды) анализ может вернуть неполный результат (partial) — такой
+    не кэшируется, не пишется в историю и не отдаётся другим участникам single-flight.
+    """
+    url = urls.canonical(url)
+    cache_key = urls.key(url, currency)
+    with _cache_lock:
+        flight = _inflight.get(cache_key)
+        leader = flight is None and budget is None
+        if leader:
+            flight = _inflight[cache_key] = {"done": threading.Event(), "result": None}
+    if flight is not None and not leader:
+        if not flight["done"].wait(budget):
+            return {"error": "Не уложились в бюджет времени", "reason": "deadline", "partial": True}
+        return flight["result"]
+
+    # Ведущий освобождает _inflight при любом исходе, иначе ожидающие зависнут,
+    # а ключ останется занятым до перезапуска
+    result = {"error": "Внутренняя ошибка анализа"}
+    try:
+        target = "seller" if "/users/" in url else "category"
+        metrics.ANALYSES_IN_FLIGHT.inc(target=target)
+        started = time.perf_counter()
+        try:
+            if target == "seller":
+                result = analyze_seller(url, currency=currency, max_reviews=max_reviews, budget=budget)
+            else:
+                result = analyze_category(url, currency=currency, budget=budget)
+        except Exception as e:
+            logger.error(f"Analysis failed for {url}: {e}")
+            result = {"error": "Внутренняя ошибка анализа"}
+        finally:
+            metrics.ANALYSES_IN_FLIGHT.dec(target=target)
+            metrics.ANALYSIS_SECONDS.observe(time.perf_counter() - started, target=target, currency=currency)
+
+        if result.get("type") != "seller" and result.get("all_lots"):
+            _index_lots(url, currency, result)
+        if "error" not in result and not result.get("partial"):
+            with _cache_lock:
+                _cache[cache_key] = {"data": result, "ts": time.time()}
+            if result.get("type") != "seller":
+                try:
+                    history.save_snapshot(url, currency, result)
+                except Exception as e:
+                    logger.error(f"Failed to save snapshot: {e}")
+    finally:
+        if leader:
+            flight["result"] = result
+            with _cache_lock:
+                _inflight.pop(cache_key, None)
+            flight["done"].set()
+    return result
+
+
+def _index_lots(url: str, currency: str, result: dict) -> None:
+    """Обновляет карту «лот → продавец» и поисковый индекс по лотам обхода категории."""
+    lots = result["all_lots"]
+    try:
+        # Владельцы лотов известны и по неполному обходу — ссылки на лоты потом не придётся загружать
+        history.remember_offer_sellers(lots)
+    except Exception as e:
+        logger.error(f"Failed to remember offer sellers: {e}")
+    # Неполный обход не должен вытеснять из поиска лоты недокачанных страниц
+    if not result.get("partial"):
+        search.index_category(url, currency, lots)
+
+
+def _analyze_in_currency(url: str, currency: str, max_reviews: int = 200, budget: Optional[float] = None,
+                         use_cache: bool = True, exact: bool = False) -> dict:
+    """
+    Анализ в валюте currency. Если курс к базовой валюте известен, цель обходится один раз
+    в базовой валюте, а цены пересчитываются (поле converted) — переключение валют в дашборде
+    не стоит новых скрейпов. Без курса или с exact=True — прямой скрейп в currency.
+    """
+    entry = None if exact or currency == rates.BASE_CURRENCY else rates.get(currency)
+    if entry is None:
+        return run_analysis(url, currency, max_reviews=max_reviews, budget=budget)
+
+    base_key = urls.key(url, rates.BASE_CURRENCY)
+    base = _cache_get(base_key) if use_cache else None
+    if base is None:
+        base = run_analysis(url, rates.BASE_CURRENCY, max_reviews=max_reviews, budget=budget)
+    if "error" in base:
+        return base
+    result = rates.convert(base, currency, entry)
+    if not result.get("partial"):
+        with _cache_lock:
+            # Пересчёт живёт не дольше данных, из которых он сделан
+            base_entry = _cache.get(base_key)
+            ts = base_entry["ts"] if base_entry and base_entry["data"] is base else time.time()
+            _cache[urls.key(url, currency)] = {"data": result, "ts": ts}
+    return result
+
+
+def _resolve_offer_page(url: str, currency: str, deadline: Optional[float] = None) -> str:
+    """Ссылка на продавца со страницы лота (и запись в карту лотов) или исходная ссылка."""
+    try:
+        from parser import _get
+        soup = _get(url, currency=currency, deadline=deadline)
+        if soup:
+            user_link_el = soup.select_one("a[href*='/users/'], div[data-href*='/users/']")
+            if user_link_el:
+                user_url = user_link_el.get("href") or user_link_el.get("data-href")
+                seller = urls.parse(user_url or "")
+                if seller and seller.is_seller:
+                    history.remember_offer_sellers([{"url": url, "seller_id": int(seller.id)}])
+                    metrics.OFFER_RESOLVE.inc(result="fetch")
+                    return seller.url
+    except Exception as e:
+        logger.error(f"Failed to extract seller from lot: {e}")
+    metrics.OFFER_RESOLVE.inc(result="miss")
+    return url
+
+
+def _resolve_and_analyze(url: str, currency: str, max_reviews: int, use_cache: bool = True,
+                         budget: Optional[float] = None, exact: bool = False) -> dict:
+    """Ссылку на лот превращает в ссылку на продавца, затем отдаёт результат из кэша или анализирует."""
+    started = time.monotonic()
+    url = urls.canonical(url)
+    cache_key = urls.key(url, currency)
+    if use_cache:
+        cached = _cache_get(cache_key)
+        # exact=True просит настоящие цены FunPay, пересчитанный результат не подходит
+        if cached is not None and not (exact and "converted" in cached):
+            return cached
+
+    # Ссылка на конкретный лот → ссылка на продавца: сначала по карте лотов из обходов категорий
+    target = urls.parse(url)
+    if target and target.is_offer:
+        seller_id = history.offer_seller(url)
+        if seller_id:
+            metrics.OFFER_RESOLVE.inc(result="map")
+            url = urls.Target("users", str(seller_id)).url
+        else:
+            url = _resolve_offer_page(url, currency, deadline=started + budget if budget else None)
+
+    resolved_key = urls.key(url, currency)
+    result = _cache_get(resolved_key) if use_cache and resolved_key != cache_key else None
+    if result is not None and exact and "converted" in result:
+        result = None
+    if result is None:
+        if budget:
+            # Остаток бюджета после поиска продавца; совсем без времени анализ не начинаем
+            left = budget - (time.monotonic() - started)
+            result = (_analyze_in_currency(url, currency, max_reviews, budget=left, use_cache=use_cache,
+                                           exact=exact) if left > 0
+                      else {"error": "Не уложились в бюджет времени", "reason": "deadline", "partial": True})
+        else:
+            result = _analyze_in_currency(url, currency, max_reviews, use_cache=use_cache, exact=exact)
+
+    # Ссылку на лот тоже кэшируем, чтобы не ходить за продавцом повторно
+    if "error" not in result and not result.get("partial") and resolved_key != cache_key:
+        with _cache_lock:
+            _cache[cache_key] = {"data": result, "ts": time.time()}
+    return result
+
+
+def _number(raw, cast=float):
+    """
+    Числовой параметр запроса: None, если он не передан; ValueError, если это не число,
+    NaN или бесконечность — такой запрос получает 400, а не падает с 500.
+    """
+    if raw is None or raw == "":
+        return None
+    try:
+        value = cast(raw)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"не число: {raw!r}")
+    if not math.isfinite(value):
+        raise ValueError(f"не число: {raw!r}")
+    return value
+
+
 @app.route("/api/analyze", methods=["POST"])
 def api_analyze():
     data = request.get_json(force=True)
@@ -1190,48 +1475,397 @@ def api_analyze():
     currency = data.get("currency", "RUB").strip().upper()
     if currency not in ["RUB", "USD", "EUR", "UAH"]:
         currency = "RUB"
-    max_reviews = int(data.get("max_reviews", 200))
-    max_reviews = max(1, min(max_reviews, 1000))
+    # ?profile=1 — разбивка по этапам, ?profile=cprofile|pyinstrument — полный профиль
+    profile = str(request.args.get("profile") or data.get("profile") or "").lower()
+    # exact=true — скрейп прямо в выбранной валюте вместо пересчёта по курсу
+    exact = bool(data.get("exact"))
+    try:
+        max_reviews = _number(data.get("max_reviews"), int)
+        # Бюджет времени (секунды): по его истечении отдаётся неполный результат с partial=True
+        budget = _number(request.args.get("budget") or data.get("budget"))
+        # enrich=N — дополнить первых N продавцов категории рейтингом и отзывами из профилей
+        enrich = _number(data.get("enrich"), int)
+        # details=N — загрузить страницы первых N лотов категории (описание, наличие, способ получения)
+        details = _number(data.get("details"), int)
+    except ValueError:
+        return jsonify({"error": "max_reviews, budget, enrich и details должны быть числами"}), 400
+    max_reviews = max(1, min(max_reviews if max_reviews is not None else 200, 1000))
+    budget = max(1.0, min(budget, MAX_BUDGET)) if budget else None
+    enrich = max(0, min(enrich or 0, MAX_ENRICH))
+    details = max(0, min(details or 0, MAX_DETAILS))
 
     if not url:
         return jsonify({"error": "URL не указан"}), 400
+    target = urls.parse(url)
+    if target is None:
+        return jsonify({"error": "Это не ссылка на категорию, продавца или лот FunPay"}), 400
+    url = target.url
+
+    if profile in ("cprofile", "pyinstrument") and not profiling.DEEP_ENABLED:
+        return jsonify({"error": "Глубокое профилирование выключено (FUNPAY_DEEP_PROFILE)"}), 403
+
+    watchlist.record_hit(url, currency)
+
+    # Попадания в кэш идут мимо очереди, скрейпы ждут своей очереди по квоте клиента
+    cheap = not profile and not enrich and not details and _cache_fresh(urls.key(url, currency), exact)
+    try:
+        with nullcontext() if cheap else scheduler.slot(_client_id(), _job_cost(target, max_reviews,
+                                                                                  enrich, details)):
+            # Профилируемый запрос всегда выполняет анализ заново, минуя кэш
+            if profile in ("cprofile", "pyinstrument"):
+                result, report = profiling.run_deep(profile, _resolve_and_analyze, url, currency, max_reviews,
+                                                    use_cache=False, budget=budget, exact=exact)
+                return jsonify({**result, "_profile": report})
+            if profile in ("1", "true", "yes"):
+                with profiling.collect() as prof:
+                    result = _resolve_and_analyze(url, currency, max_reviews, use_cache=False, budget=budget,
+                                                  exact=exact)
+                return jsonify({**result, "_profile": profiling.summary(prof)})
+
+            started = time.monotonic()
+            result = _resolve_and_analyze(url, currency, max_reviews, budget=budget, exact=exact)
+            if enrich and result.get("top_sellers") and "error" not in result:
+                left = budget - (time.monotonic() - started) if budget else None
+                if left is None or left > 0:
+                    result = enrich_top_sellers(result, enrich, budget=left)
+            if details and result.get("all_lots") and "error" not in result:
+                left = budget - (time.monotonic() - started) if budget else None
+                if left is None or left > 0:
+                    result = crawl_lot_details(result, details, currency=currency, budget=left)
+    except scheduler.Rejected as e:
+        return _rejected(e)
+    return jsonify(result), _REASON_STATUS.get(result.get("reason"), 200)
+
+
+MAX_COMPARE = 30
+
+
+def _compare_row(url: str, result: dict) -> dict:
+    """Строка матрицы сравнения категорий."""
+    if "error" in result:
+        return {"url": url, "error": result["error"], "reason": result.get("reason")}
+    sellers = result.get("total_sellers", 0)
+    niches = result.get("market_opportunities") or []
+    return {
+        "url":           url,
+        "category":      history.category_key(url),
+        "total_lots":    result.get("total_lots", 0),
+        "total_sellers": sellers,
+        "price_median":  result.get("price_median", 0),
+        "online_ratio":  round(result.get("online_sellers", 0) / sellers, 3) if sellers else 0,
+        "best_niche":    niches[0] if niches else None,
+    }
 
-    if url.isdigit():
-        url = f"https://funpay.com/lots/{url}/"
 
-    cache_key = f"{url}_{currency}"
+@app.route("/api/compare", methods=["POST"])
+def api_compare():
+    """
+    Сравнение нескольких категорий. Категории анализируются параллельно
+    (в рамках общего бюджета запросов), строки отдаются по мере готовности
+    в формате NDJSON, последней строкой — итоговая матрица.
+    """
+    data = request.get_json(force=True)
+    currency = data.get("currency", "RUB").strip().upper()
+    if currency not in ["RUB", "USD", "EUR", "UAH"]:
+        currency = "RUB"
+    categories = []
+    for raw in data.get("urls", []):
+        target = urls.parse(str(raw))
+        if target and target.is_category and target.url not in categories:
+            categories.append(target.url)
+    if not categories:
+        return jsonify({"error": "Не указаны категории"}), 400
+    if len(categories) > MAX_COMPARE:
+        return jsonify({"error": f"Не больше {MAX_COMPARE} категорий за раз"}), 400
+    client = _client_id()
+    try:
+        scheduler.charge(client, sum(_job_cost(urls.parse(u), 0) for u in categories
+                                     if not _cache_fresh(urls.key(u, currency))))
+    except scheduler.Rejected as e:
+        return _rejected(e)
+
+    def _analyze(url: str) -> dict:
+        cached = _cache_get(urls.key(url, currency))
+        if cached is not None:
+            return cached
+        # Квота списана выше, но каждый скрейп ждёт своей очереди с весом клиента
+        with scheduler.slot(client, _job_cost(urls.parse(url), 0), prepaid=True):
+            return _analyze_in_currency(url, currency)
+
+    def generate():
+        rows = {}
+        with ThreadPoolExecutor(max_workers=min(len(categories), MAX_CONCURRENT_FETCHES)) as pool:
+            futures = {pool.submit(_analyze, url): url for url in categories}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    row = _compare_row(url, future.result())
+                except Exception as e:
+                    logger.error(f"Compare failed for {url}: {e}")
+                    row = {"url": url, "error": "Внутренняя ошибка анализа"}
+                rows[url] = row
+                yield json.dumps({"type": "category", **row}, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "type":     "matrix",
+            "currency": currency,
+            "rows":     [rows[u] for u in categories],
+        }, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+MAX_COMPARE_SELLERS = 10
+
+
+def _seller_row(url: str, result: dict) -> dict:
+    """Строка сравнения продавцов: рейтинг, распределение оценок и диапазон цен лотов."""
+    if "error" in result:
+        return {"url": url, "error": result["error"], "reason": result.get("reason")}
+    stars = {r["stars"]: r["count"] for r in result.get("rating_dist", [])}
+    prices = sorted(l["price"] for l in result.get("lots", []) if l["price"] > 0)
+    return {
+        "url":            url,
+        "user_id":        result.get("user_id"),
+        "name":           result.get("name"),
+        "rating":         result.get("rating", 0.0),
+        "total_reviews":  result.get("total_reviews", 0),
+        "reviews_parsed": result.get("reviews_parsed", 0),
+        "online":         result.get("online", False),
+        "lots_count":     result.get("lots_count", 0),
+        "price_min":      prices[0] if prices else 0,
+        "price_median":   prices[len(prices) // 2] if prices else 0,
+        "price_max":      prices[-1] if prices else 0,
+        # Число отзывов с 1..5 звёздами
+        "rating_dist":    [stars.get(s, 0) for s in range(1, 6)],
+        "partial":        result.get("partial", False),
+    }
 
-    with _cache_lock:
-        cached = _cache.get(cache_key)
-        if cached and time.time() - cached["ts"] < 300:
-            return jsonify(cached["data"])
 
-    # Ссылка на конкретный лот → достаём профиль продавца
-    if "/lots/offer" in url or "?id=" in url:
-        try:
-            from parser import _get
-            soup = _get(url, currency=currency)
-            if soup:
-                user_link_el = soup.select_one("a[href*='/users/'], div[data-href*='/users/']")
-                if user_link_el:
-                    user_url = user_link_el.get("href") or user_link_el.get("data-href")
-                    if user_url:
-                        url = user_url if user_url.startswith("http") else "https://funpay.com" + user_url
-        except Exception as e:
-            logger.error(f"Failed to extract seller from lot: {e}")
+@app.route("/api/compare/sellers", methods=["POST"])
+def api_compare_sellers():
+    """
+    Сравнение продавцов (id или ссылки). Продавцы анализируются параллельно в рамках
+    общего бюджета запросов, строки отдаются в NDJSON по мере готовности, последней
+    строкой — матрица с выровненными по месяцам рядами отзывов (sales_by_month).
+    """
+    data = request.get_json(force=True)
+    currency = data.get("currency", "RUB").strip().upper()
+    if currency not in ["RUB", "USD", "EUR", "UAH"]:
+        currency = "RUB"
+    max_reviews = max(1, min(int(data.get("max_reviews", 200)), 1000))
+    sellers = []
+    for raw in data.get("sellers", []):
+        raw = str(raw).strip()
+        # Голый номер здесь — id продавца, а не категории
+        target = urls.Target("users", raw) if raw.isdigit() else urls.parse(raw)
+        if target and target.is_seller and target.url not in sellers:
+            sellers.append(target.url)
+    if not sellers:
+        return jsonify({"error": "Не указаны продавцы"}), 400
+    if len(sellers) > MAX_COMPARE_SELLERS:
+        return jsonify({"error": f"Не больше {MAX_COMPARE_SELLERS} продавцов за раз"}), 400
+    client = _client_id()
+    try:
+        scheduler.charge(client, sum(_job_cost(urls.parse(u), max_reviews) for u in sellers
+                                     if not _cache_fresh(urls.key(u, currency))))
+    except scheduler.Rejected as e:
+        return _rejected(e)
+
+    def _analyze(url: str) -> dict:
+        cached = _cache_get(urls.key(url, currency))
+        if cached is not None:
+            return cached
+        with scheduler.slot(client, _job_cost(urls.parse(url), max_reviews), prepaid=True):
+            return _analyze_in_currency(url, currency, max_reviews)
+
+    def generate():
+        rows, sales = {}, {}
+        with ThreadPoolExecutor(max_workers=min(len(sellers), MAX_CONCURRENT_FETCHES)) as pool:
+            futures = {pool.submit(_analyze, url): url for url in sellers}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    result = future.result()
+                    row = _seller_row(url, result)
+                    sales[url] = {m["month"]: m["count"] for m in result.get("sales_by_month", [])}
+                except Exception as e:
+                    logger.error(f"Seller compare failed for {url}: {e}")
+                    row = {"url": url, "error": "Внутренняя ошибка анализа"}
+                rows[url] = row
+                yield json.dumps({"type": "seller", **row}, ensure_ascii=False) + "\n"
+        months = sort_months(m for by_month in sales.values() for m in by_month)
+        yield json.dumps({
+            "type":     "matrix",
+            "currency": currency,
+            "months":   months,
+            "rows":     [{**rows[u], "sales_by_month": [sales.get(u, {}).get(m, 0) for m in months]}
+                         for u in sellers],
+        }, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _stored_currency(currency: str) -> tuple[str, Optional[dict]]:
+    """
+    В какой валюте читать историю, индекс продавцов и поиск. Их пополняют только скрейпы,
+    а при известном курсе скрейп идёт в базовой валюте (см. _analyze_in_currency), поэтому
+    читаются данные базовой валюты, а цены пересчитываются по курсу — он второе значение.
+    Без курса читаются данные самой currency, как от прямого скрейпа.
+    """
+    entry = None if currency == rates.BASE_CURRENCY else rates.get(currency)
+    return (rates.BASE_CURRENCY, entry) if entry else (currency, None)
+
+
+@app.route("/api/history")
+def api_history():
+    url = request.args.get("url", "").strip()
+    if not url:
+        return jsonify({"error": "URL не указан"}), 400
+    currency = request.args.get("currency", "RUB").strip().upper()
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("raw", "hour", "day"):
+        return jsonify({"error": "granularity: raw, hour или day"}), 400
+    # Нечисловое значение даёт 30 дней, остальное — от часа до года
+    days = max(1 / 24, min(request.args.get("days", 30, type=float), 365))
+    since = time.time() - days * 86400
+    source, entry = _stored_currency(currency)
+    series = history.get_timeseries(url, source, granularity, since=since)
+    snapshots = history.list_snapshots(url, source, limit=20)
+    result = {
+        "category":    history.category_key(url),
+        "currency":    currency,
+        "granularity": granularity,
+    }
+    if entry:
+        rate = entry["rate"]
+        series = rates.convert_prices(series, ("price_median", "price_avg", "price_min", "price_max"), rate)
+        snapshots = rates.convert_prices(snapshots, ("price_median",), rate)
+        result["converted"] = rates.note(currency, entry)
+    return jsonify({**result, "series": series, "snapshots": snapshots})
 
-    if "/users/" in url:
-        result = analyze_seller(url, currency=currency, max_reviews=max_reviews)
-    else:
-        result = analyze_category(url, currency=currency)
 
-    if "error" not in result:
-        with _cache_lock:
-            _cache[cache_key] = {"data": result, "ts": time.time()}
+@app.route("/api/diff")
+def api_diff():
+    url = request.args.get("url", "").strip()
+    if not url:
+        return jsonify({"error": "URL не указан"}), 400
+    currency = request.args.get("currency", "RUB").strip().upper()
+    old_id = request.args.get("from", type=int)
+    new_id = request.args.get("to", type=int)
+    source, entry = _stored_currency(currency)
+    result = history.diff_snapshots(url, source, old_id=old_id, new_id=new_id)
+    if "error" in result:
+        return jsonify(result), 404
+    if entry:
+        rate = entry["rate"]
+        result.update({
+            "currency":  currency,
+            "added":     rates.convert_prices(result["added"], ("price",), rate),
+            "removed":   rates.convert_prices(result["removed"], ("price",), rate),
+            "repriced":  rates.convert_prices(result["repriced"], ("price", "old_price", "change"), rate),
+            "converted": rates.note(currency, entry),
+        })
+    return jsonify(result)
+
+
+@app.route("/api/seller_index")
+def api_seller_index():
+    name = request.args.get("name", "").strip()
+    seller_id = request.args.get("id", type=int)
+    if not name and seller_id is None:
+        return jsonify({"error": "Не указан продавец"}), 400
+    currency = request.args.get("currency", "RUB").strip().upper()
+    source, entry = _stored_currency(currency)
+    result = history.get_seller_footprint(name or None, source, seller_id=seller_id)
+    if not result["total_lots"]:
+        return jsonify({**result, "error": "Продавец не встречался в обойдённых категориях"}), 404
+    if entry:
+        rate = entry["rate"]
+        result["categories"] = [
+            {**c, "lots": rates.convert_prices(c["lots"], ("price",), rate)}
+            for c in rates.convert_prices(result["categories"],
+                                          ("category_median", "min_price", "max_price", "avg_price"), rate)
+        ]
+        result.update({"currency": currency, "converted": rates.note(currency, entry)})
+    return jsonify(result)
+
 
+@app.route("/api/search")
+def api_search():
+    query = request.args.get("q", "").strip()
+    currency = request.args.get("currency", "RUB").strip().upper()
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    min_price = request.args.get("min_price", type=float)
+    max_price = request.args.get("max_price", type=float)
+    source, entry = _stored_currency(currency)
+    if entry:
+        # Границы цены приходят в currency, а индекс хранит цены базовой валюты
+        min_price = min_price / entry["rate"] if min_price is not None else None
+        max_price = max_price / entry["rate"] if max_price is not None else None
+    result = search.search(
+        query,
+        currency=source,
+        category=request.args.get("category") or None,
+        seller=request.args.get("seller") or None,
+        min_price=min_price,
+        max_price=max_price,
+        limit=limit,
+    )
+    if entry:
+        rate = entry["rate"]
+        result["results"] = rates.convert_prices(result["results"], ("price",), rate)
+        result["facets"]["price"] = rates.convert_prices([result["facets"]["price"]], ("min", "median", "max"),
+                                                         rate)[0]
+        result["converted"] = rates.note(currency, entry)
     return jsonify(result)
 
 
+@app.route("/api/watchlist", methods=["GET"])
+def api_watchlist():
+    return jsonify(watchlist.list_entries())
+
+
+@app.route("/api/watchlist", methods=["POST"])
+def api_watchlist_add():
+    data = request.get_json(force=True)
+    url = data.get("url", "").strip()
+    if not url:
+        return jsonify({"error": "URL не указан"}), 400
+    target = urls.parse(url)
+    if target is None:
+        return jsonify({"error": "Это не ссылка на категорию, продавца или лот FunPay"}), 400
+    url = target.url
+    currency = data.get("currency", "RUB").strip().upper()
+    if currency not in ["RUB", "USD", "EUR", "UAH"]:
+        currency = "RUB"
+    interval = int(data.get("interval", watchlist.DEFAULT_INTERVAL))
+    max_reviews = max(1, min(int(data.get("max_reviews", 200)), 1000))
+    return jsonify(watchlist.add(url, currency, interval=interval, max_reviews=max_reviews))
+
+
+@app.route("/api/watchlist", methods=["DELETE"])
+def api_watchlist_remove():
+    data = request.get_json(force=True)
+    target = urls.parse(data.get("url", ""))
+    if target is None:
+        return jsonify({"error": "Это не ссылка на категорию, продавца или лот FunPay"}), 400
+    url = target.url
+    currency = data.get("currency", "RUB").strip().upper()
+    if not watchlist.remove(url, currency):
+        return jsonify({"error": "Цель не найдена"}), 404
+    return jsonify({"ok": True})
+
+
+@app.route("/api/scheduler")
+def api_scheduler():
+    return jsonify(scheduler.stats())
+
+
+@app.route("/api/rates")
+def api_rates():
+    return jsonify({"base": rates.BASE_CURRENCY, "rates": rates.get_all()})
+
+
 @app.route("/api/categories")
 def api_categories():
     cats = get_categories()
@@ -1243,4 +1877,13 @@ if __name__ == "__main__":
     print("  FunPay Analytics Dashboard")
     print("  http://localhost:5000")
     print("=" * 50)
+    threading.Thread(target=search.load_from_history, name="search-warmup", daemon=True).start()
+    warmcache.load(CACHE_TTL)
+    warmcache.start(_cache_snapshot)
+    # SIGTERM при деплое — обычный выход, чтобы кэш успел сохраниться (atexit)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # Список наблюдения обновляет базовую валюту скрейпом, остальные — пересчётом
+    # Ссылки на лоты в списке обновляются через продавца, как и в /api/analyze
+    watchlist.start(partial(_resolve_and_analyze, use_cache=False))
+    rates.start()
     app.run(debug=False, host="0.0.0.0", port=5000)
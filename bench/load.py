@@ -0,0 +1,88 @@
+"""
+FunPay Analytics — нагрузочный генератор для /api/analyze
+Запуск:   python bench/load.py --users 20 --duration 60 [--api http://127.0.0.1:5000]
+                               [--funpay http://127.0.0.1:8800] [--categories 50] [--sellers 0.2]
+
+N виртуальных пользователей без пауз шлют POST /api/analyze на случайные
+категории и продавцов заглушки (bench/mock_funpay.py). В конце печатаются
+пропускная способность API и хвосты задержек (p50/p90/p99/max).
+"""
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+
+import requests
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _user(args, deadline: float, latencies: list, outcomes: Counter, lock: threading.Lock, seed: int):
+    rnd = random.Random(seed)
+    session = requests.Session()
+    # Для квот дашборда каждый виртуальный пользователь — отдельный клиент
+    # (app.py с FUNPAY_CLIENT_HEADER=X-Client-Id)
+    session.headers["X-Client-Id"] = f"load-{seed}"
+    while time.monotonic() < deadline:
+        if rnd.random() < args.sellers:
+            url = f"{args.funpay}/users/{rnd.randint(1, args.categories)}/"
+        else:
+            url = f"{args.funpay}/lots/{rnd.randint(1, args.categories)}/"
+        t0 = time.perf_counter()
+        try:
+            r = session.post(f"{args.api}/api/analyze", json={"url": url, "currency": "RUB"},
+                             timeout=args.timeout)
+            outcome = str(r.status_code) if r.ok and "error" not in r.json() else f"{r.status_code} error"
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            outcomes[outcome] += 1
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Нагрузочный тест API FunPay Analytics")
+    ap.add_argument("--api", default="http://127.0.0.1:5000", help="адрес app.py")
+    ap.add_argument("--funpay", default="http://127.0.0.1:8800", help="адрес заглушки (FUNPAY_BASE_URL)")
+    ap.add_argument("--users", type=int, default=10, help="одновременных пользователей")
+    ap.add_argument("--duration", type=float, default=30, help="длительность, с")
+    ap.add_argument("--categories", type=int, default=50,
+                    help="разных категорий/продавцов (чем больше, тем реже попадания в кэш)")
+    ap.add_argument("--sellers", type=float, default=0.2, help="доля запросов к продавцам")
+    ap.add_argument("--timeout", type=float, default=120, help="таймаут одного запроса, с")
+    args = ap.parse_args()
+    args.api, args.funpay = args.api.rstrip("/"), args.funpay.rstrip("/")
+
+    latencies: list[float] = []
+    outcomes: Counter = Counter()
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=_user, args=(args, deadline, latencies, outcomes, lock, i), daemon=True)
+               for i in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - started
+
+    lat = sorted(latencies)
+    print(f"Пользователей: {args.users}, длительность: {wall:.1f} с, запросов: {len(lat)}")
+    print(f"Пропускная способность: {len(lat) / wall:.2f} запр./с")
+    if lat:
+        print("Задержка, с:  " + "  ".join(
+            f"{name} {_percentile(lat, q):.3f}" for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+        ) + f"  max {lat[-1]:.3f}")
+    print("Ответы:       " + ", ".join(f"{k}: {v}" for k, v in outcomes.most_common()))
+    return 0 if lat else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
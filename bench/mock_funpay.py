@@ -0,0 +1,173 @@
+"""
+FunPay Analytics — локальная заглушка funpay.com для нагрузочных тестов
+Запуск:   python bench/mock_funpay.py [--port 8800] [--lots 1000] [--latency 50-300]
+                                      [--error-rate 0.02] [--rate-limit 20]
+Затем:    FUNPAY_BASE_URL=http://127.0.0.1:8800 python app.py
+
+Отдаёт категории /lots/N/ (и ?page=N), профили /users/N/ (и ?skip=N) и лоты
+/lots/offer?id=N, собранные из bench/fixtures. Задержка, доля ответов 500 и
+лимит запросов в секунду (сверх него — 429 с Retry-After) настраиваются.
+Цены пересчитываются в валюту из куки cy по фиксированным курсам RATES.
+Адрес лучше указывать как 127.0.0.1, а не localhost: на хост без точки
+requests не отправит куку валюты.
+"""
+import re
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from pages import Pages
+
+# Курсы рубля, по которым заглушка отдаёт цены в других валютах (кука cy)
+RATES = {"RUB": (1.0, "₽"), "USD": (0.011, "$"), "EUR": (0.0102, "€"), "UAH": (0.45, "₴")}
+_PRICE_RE = re.compile(r'(\d[\d ]*(?:\.\d+)?) <span class="unit">₽')
+
+
+class TokenBucket:
+    """Общий на сервер лимит запросов в секунду (0 — без лимита)."""
+
+    def __init__(self, rate: float, burst: float = 0):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class MockFunPay(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, lots: int, pages: int, reviews: int, latency: tuple[float, float],
+                 error_rate: float, rate_limit: float):
+        super().__init__(address, Handler)
+        self.lots = lots
+        self.pages = pages
+        self.reviews = reviews
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit)
+        self.base_url = f"http://{address[0]}:{self.server_address[1]}"
+        # У каждой категории свой набор цен и продавцов
+        self._categories: dict[int, Pages] = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+    def category(self, cat_id: int) -> Pages:
+        with self._lock:
+            if cat_id not in self._categories:
+                self._categories[cat_id] = Pages(seed=cat_id)
+            return self._categories[cat_id]
+
+    def count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: MockFunPay
+
+    def do_GET(self):
+        srv = self.server
+        srv.count("requests")
+        if not srv.bucket.take():
+            srv.count("throttled")
+            return self._send(429, "Too Many Requests", {"Retry-After": "1"})
+        time.sleep(random.uniform(*srv.latency))
+        if random.random() < srv.error_rate:
+            srv.count("errors")
+            return self._send(500, "Internal Server Error")
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/lots/offer"):
+            offer_id = int(query.get("id", ["0"])[0])
+            body = srv.category(0).offer_page(offer_id, user_id=offer_id % 997 + 1)
+        elif m := re.match(r"/(?:lots|chips)/(\d+)/?$", url.path):
+            page = int(query.get("page", ["1"])[0])
+            if page > srv.pages:
+                return self._send(404, "Not Found")
+            body = srv.category(int(m.group(1))).category_page(srv.lots, page, srv.pages)
+        elif re.match(r"/users/\d+/?$", url.path):
+            skip = int(query.get("skip", ["0"])[0])
+            body = srv.category(0).seller_page(skip, total_reviews=srv.reviews)
+        elif url.path == "/":
+            body = ('<html><body><div class="promo-game-item"><a href="/lots/610/">'
+                    '<div class="game-title">PUBG Mobile</div></a></div></body></html>')
+        else:
+            return self._send(404, "Not Found")
+        body = _in_currency(body, self.headers.get("Cookie", ""))
+        self._send(200, body.replace("https://funpay.com", srv.base_url))
+
+    def _send(self, status: int, body: str, headers: dict = None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # тысячи строк доступа только мешают
+
+
+def _in_currency(body: str, cookie: str) -> str:
+    """Пересчитывает цены страницы в валюту из куки cy, как это делает FunPay."""
+    m = re.search(r"\bcy=(\w+)", cookie)
+    currency = m.group(1) if m and m.group(1) in RATES else "RUB"
+    if currency == "RUB":
+        return body
+    rate, symbol = RATES[currency]
+    return _PRICE_RE.sub(lambda p: f'{round(float(p.group(1).replace(" ", "")) * rate, 2)} '
+                                   f'<span class="unit">{symbol}', body)
+
+
+def _parse_latency(value: str) -> tuple[float, float]:
+    """'50' или '50-300' (мс) → интервал в секундах."""
+    lo, _, hi = value.partition("-")
+    return float(lo) / 1000, float(hi or lo) / 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Локальная заглушка funpay.com")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8800)
+    ap.add_argument("--lots", type=int, default=1000, help="лотов в каждой категории")
+    ap.add_argument("--pages", type=int, default=2, help="страниц в категории (?page=N)")
+    ap.add_argument("--reviews", type=int, default=500, help="отзывов у каждого продавца (?skip=N)")
+    ap.add_argument("--latency", default="50-300", help="задержка ответа, мс: '100' или '50-300'")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="запросов в секунду до 429 (0 — без лимита)")
+    args = ap.parse_args()
+
+    server = MockFunPay((args.host, args.port), lots=args.lots, pages=args.pages, reviews=args.reviews,
+                        latency=_parse_latency(args.latency), error_rate=args.error_rate,
+                        rate_limit=args.rate_limit)
+    print(f"Заглушка FunPay: {server.base_url}  (FUNPAY_BASE_URL={server.base_url})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\nЗапросов: {server.stats['requests']}, ошибок 500: {server.stats['errors']}, "
+              f"429: {server.stats['throttled']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+FunPay Analytics — синтетические страницы FunPay для бенчмарков и заглушки
+Категории, профили и отзывы собираются из записанных bench/fixtures/*.html,
+так что разметка совпадает с настоящей, а размер задаётся параметрами.
+"""
+import os
+import re
+import random
+from typing import Optional
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REVIEWS_PER_PAGE = 25
+
+
+def _read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class Pages:
+    """Генератор страниц FunPay: записанные фикстуры + масштабированные копии."""
+
+    def __init__(self, seed: int = 42):
+        self.category = _read_fixture("category.html")
+        self.seller = _read_fixture("seller.html")
+        self.offer_templates = re.findall(r'<a href="[^"]*" class="tc-item".*?</a>', self.category, re.S)
+        self.review_templates = re.findall(
+            r'<div class="review-item">.*?review-item-text">.*?</div>\s*</div>\s*</div>', self.seller, re.S)
+        self.seed = seed
+        self._category_cache: dict[tuple[int, int], str] = {}
+
+    def category_page(self, total_lots: int, page: int, pages: int = 2) -> str:
+        """Страница категории: total_lots лотов, поровну на pages страниц."""
+        key = (total_lots, page)
+        if key in self._category_cache:
+            return self._category_cache[key]
+        rnd = random.Random(self.seed * 1000 + page)
+        per_page = total_lots // pages
+        offers = []
+        for i in range(per_page):
+            tpl = self.offer_templates[i % len(self.offer_templates)]
+            offer_id = page * 10_000_000 + i
+            seller_no = rnd.randint(1, max(10, total_lots // 20))
+            price = round(rnd.lognormvariate(5, 1.2), 2)
+            html = re.sub(r"id=\d+", f"id={offer_id}", tpl)
+            html = re.sub(r"/users/\d+/", f"/users/{seller_no}/", html)
+            html = re.sub(r'(data-href="[^"]*">)[^<]+(</span>)', rf"\g<1>seller{seller_no}\g<2>", html)
+            html = re.sub(r"<div>[\d\s.]+ <span class=\"unit\">", f'<div>{price} <span class="unit">', html)
+            html = re.sub(r'(rating-mini-count">)[\d\s]+', rf"\g<1>{seller_no * 7 % 5000}", html)
+            offers.append(html)
+        head, _, rest = self.category.partition(self.offer_templates[0])
+        tail = rest.rpartition(self.offer_templates[-1])[2]
+        if page >= pages:
+            tail = re.sub(r'<ul class="pagination">.*?</ul>', "", tail, flags=re.S)
+        result = head + "\n".join(offers) + tail
+        self._category_cache[key] = result
+        return result
+
+    def seller_page(self, skip: int, total_reviews: Optional[int] = None) -> str:
+        """
+        Профиль продавца; ?skip=N — следующая порция из REVIEWS_PER_PAGE отзывов.
+        При total_reviews последняя страница неполная, а дальше отзывов нет.
+        """
+        count = REVIEWS_PER_PAGE
+        if total_reviews is not None:
+            count = max(0, min(count, total_reviews - skip))
+        reviews = []
+        for i in range(count):
+            tpl = self.review_templates[i % len(self.review_templates)]
+            month = ["январь", "февраль", "март", "апрель", "май", "июнь"][(skip // REVIEWS_PER_PAGE + i) % 6]
+            html = re.sub(r'(review-item-date">)[^<]+', rf"\g<1>{month} 2025", tpl)
+            html = re.sub(r'(review-item-text">)[^<]+', rf"\g<1>Отзыв #{skip + i}: всё отлично", html)
+            reviews.append(html)
+        start = self.seller.index(self.review_templates[0])
+        end = self.seller.index(self.review_templates[-1]) + len(self.review_templates[-1])
+        return self.seller[:start] + "\n".join(reviews) + self.seller[end:]
+
+    def offer_page(self, offer_id: int, user_id: int) -> str:
+        """Страница лота /lots/offer?id=N: продавец, описания, наличие и способ получения."""
+        rnd = random.Random(self.seed * 7919 + offer_id)
+        auto = rnd.random() < 0.4
+        delivery = "Автоматическая выдача" if auto else "Вручную, по ID игрока"
+        return (f'<!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8"><title>Лот {offer_id} — FunPay</title>'
+                f'</head><body><div class="param-list">'
+                f'<div class="param-item"><h5>Краткое описание</h5><div>{rnd.choice((60, 325, 660))} UC по ID</div></div>'
+                f'<div class="param-item"><h5>Подробное описание</h5><div>Пополнение UC по ID игрока. '
+                f'Выполняю заказы {rnd.choice(("за 5 минут", "в течение часа", "24/7"))}. Гарантия возврата.</div></div>'
+                f'<div class="param-item"><h5>Наличие</h5><div>{rnd.randint(1, 5000)} шт.</div></div>'
+                f'<div class="param-item"><h5>Способ получения</h5><div>{delivery}</div></div>'
+                f'</div><div class="param-item"><div class="media-user-name">'
+                f'<a href="https://funpay.com/users/{user_id}/">seller{user_id}</a></div></div></body></html>')
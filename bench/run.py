@@ -0,0 +1,204 @@
+"""
+FunPay Analytics — бенчмарки парсера и API на записанных страницах
+Запуск:   python bench/run.py [--sizes 1000,10000] [--save-baseline] [--tolerance 0.25]
+
+Работает полностью офлайн: запросы парсера обслуживает FixtureAdapter из
+bench/fixtures/*.html, а категории на 1k/10k/100k лотов синтезируются из
+карточек записанной страницы. Результат сравнивается с bench/baseline.json.
+"""
+import os
+import re
+import sys
+import json
+import logging
+import time
+import random
+import argparse
+import tempfile
+import datetime
+import tracemalloc
+
+import requests
+from requests.adapters import BaseAdapter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# История пишется во временную базу, чтобы не трогать рабочую
+os.environ.setdefault("FUNPAY_HISTORY_DB", os.path.join(tempfile.mkdtemp(prefix="funpay-bench-"), "history.db"))
+
+import memo  # noqa: E402
+import parser  # noqa: E402
+import urls  # noqa: E402
+from pages import Pages  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+NOISE_FLOOR = {"seconds": 0.005, "peak_mb": 1.0}
+
+
+class FixtureAdapter(BaseAdapter):
+    """Транспорт requests, отвечающий синтетическими страницами вместо funpay.com."""
+
+    def __init__(self, pages: Pages):
+        super().__init__()
+        self.pages = pages
+        self.category_size = 1000
+
+    def send(self, request, **kwargs):
+        url = request.url
+        if "/users/" in url:
+            m = re.search(r"skip=(\d+)", url)
+            body = self.pages.seller_page(int(m.group(1)) if m else 0)
+        elif "/lots/" in url:
+            m = re.search(r"page=(\d+)", url)
+            body = self.pages.category_page(self.category_size, int(m.group(1)) if m else 1)
+        else:
+            body = "<html></html>"
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = body.encode("utf-8")
+        resp.encoding = "utf-8"
+        resp.url = url
+        resp.request = request
+        resp.elapsed = datetime.timedelta(0)
+        return resp
+
+    def close(self):
+        pass
+
+
+# ── Замеры ──
+
+def _measure(func, repeat: int) -> dict:
+    """Лучшее время из repeat прогонов и пиковая память отдельного прогона под tracemalloc."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(best, 4), "peak_mb": round(peak / 1024 / 1024, 2)}
+
+
+def _cold(func, *args, **kwargs):
+    """Вызов func с предварительно очищенным memo разбора страниц."""
+    def call():
+        memo.clear()
+        return func(*args, **kwargs)
+    return call
+
+
+def run(sizes: list[int], repeat: int) -> dict:
+    pages = Pages()
+    adapter = FixtureAdapter(pages)
+    for session in parser.SESSIONS:
+        session.mount("https://", adapter)
+    parser.POLITE_DELAY = (0, 0)
+    parser.BACKOFF_BASE = 0
+
+    import app as flask_app
+    # Пошаговые логи парсера на тысячах страниц заглушают таблицу результатов
+    logging.getLogger("FunPayAnalyst").setLevel(logging.WARNING)
+    client = flask_app.app.test_client()
+    url = "https://funpay.com/lots/610/"
+    results = {}
+
+    for n in sizes:
+        adapter.category_size = n
+        reps = 1 if n >= 100_000 else repeat
+        # Генерацию синтетических страниц в замер не включаем
+        pages.category_page(n, 1)
+        pages.category_page(n, 2)
+
+        # Основные замеры — с холодным memo, чтобы разбор страниц действительно выполнялся
+        r = _measure(_cold(parser.get_lots_in_category, url), reps)
+        results[f"get_lots_in_category[{n}]"] = {**r, "throughput": round(n / r["seconds"])}
+
+        # Повторный разбор тех же страниц: результат из memo по хэшу тела
+        parser.get_lots_in_category(url)
+        r = _measure(lambda: parser.get_lots_in_category(url), reps)
+        results[f"get_lots_in_category_memo[{n}]"] = {**r, "throughput": round(n / r["seconds"])}
+
+        r = _measure(_cold(parser.analyze_category, url), reps)
+        results[f"analyze_category[{n}]"] = {**r, "throughput": round(n / r["seconds"])}
+
+        prices = [random.lognormvariate(5, 1.2) for _ in range(n)]
+        r = _measure(lambda: parser._price_buckets(prices), max(reps, 5))
+        results[f"_price_buckets[{n}]"] = {**r, "throughput": round(n / r["seconds"])}
+
+        # Путь сериализации /api/analyze: результат уже в кэше, замеряем только ответ
+        analysis = parser.analyze_category(url)
+        with flask_app._cache_lock:
+            flask_app._cache[urls.key(url, "RUB")] = {"data": analysis, "ts": time.time() + 10 ** 9}
+        r = _measure(lambda: client.post("/api/analyze", json={"url": url, "currency": "RUB"}).get_data(), reps)
+        results[f"api_analyze_serialize[{n}]"] = {**r, "throughput": round(n / r["seconds"])}
+        print(f"  {n} лотов готово", flush=True)
+
+    for max_reviews in (200, 1000):
+        r = _measure(_cold(parser.analyze_seller, "1048576", max_reviews=max_reviews), repeat)
+        results[f"analyze_seller[{max_reviews}]"] = {**r, "throughput": round(max_reviews / r["seconds"])}
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Список регрессий: время или память выросли больше чем на tolerance."""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for field in ("seconds", "peak_mb"):
+            # Доли миллисекунды и мегабайта — шум, а не регрессия
+            if cur[field] - base[field] < NOISE_FLOOR[field]:
+                continue
+            if base[field] and cur[field] > base[field] * (1 + tolerance):
+                regressions.append(f"{name}: {field} {base[field]} → {cur[field]} "
+                                   f"(+{(cur[field] / base[field] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарки FunPay Analytics на офлайн-фикстурах")
+    ap.add_argument("--sizes", default="1000,10000,100000", help="размеры синтетических категорий")
+    ap.add_argument("--repeat", type=int, default=3, help="прогонов на замер (берётся лучший)")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение относительно базы")
+    ap.add_argument("--save-baseline", action="store_true", help="записать результат как новую базу")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run(sizes, args.repeat)
+
+    print(f"\n{'бенчмарк':<36}{'время, с':>10}{'память, МБ':>12}{'ед./с':>12}")
+    for name, r in results.items():
+        print(f"{name:<36}{r['seconds']:>10}{r['peak_mb']:>12}{r['throughput']:>12}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nБаза сохранена в {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print("\nБазы нет — запустите с --save-baseline")
+        return 0
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("\nРегрессии:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
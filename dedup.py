@@ -0,0 +1,113 @@
+"""
+FunPay Analytics — поиск почти одинаковых лотов
+MinHash-подписи названий + LSH по полосам: кластеризация за почти линейное время.
+"""
+import re
+import struct
+import hashlib
+from typing import Optional
+
+NUM_PERM = 32              # длина MinHash-подписи
+BANDS = 8                  # полос LSH (по NUM_PERM // BANDS строк)
+SIMILARITY = 0.6           # порог оценки сходства Жаккара для склейки
+
+_ROWS = NUM_PERM // BANDS
+_UNPACK = struct.Struct(f"<{NUM_PERM}H").unpack
+_NUM_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_JUNK_RE = re.compile(r"[^\w#]+", re.UNICODE)
+
+
+def normalize_title(title: str) -> str:
+    """
+    Приводит название к «скелету»: нижний регистр, без эмодзи и пунктуации,
+    все числа заменены на '#' — так «100 UC 🔥» и «200 UC ⚡» совпадают.
+    """
+    s = _NUM_RE.sub("#", title.lower())
+    return _JUNK_RE.sub(" ", s).strip()
+
+
+def _shingles(text: str) -> set[str]:
+    """Шинглы названия: слова и пары соседних слов."""
+    words = text.split()
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def _signature(text: str, memo: dict[str, tuple]) -> tuple:
+    """
+    MinHash-подпись: один blake2b на шингл даёт сразу NUM_PERM 16-битных хэшей,
+    поэлементный минимум считается через zip/min на стороне C.
+    """
+    hashes = []
+    for sh in _shingles(text):
+        h = memo.get(sh)
+        if h is None:
+            h = memo[sh] = _UNPACK(hashlib.blake2b(sh.encode(), digest_size=NUM_PERM * 2).digest())
+        hashes.append(h)
+    return tuple(map(min, zip(*hashes)))
+
+
+def _find(parent: list[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def cluster_lots(lots: list[dict], by_seller: bool = True) -> list[int]:
+    """
+    Возвращает id кластера для каждого лота (id = индекс первого лота кластера).
+    При by_seller=True дубликатами считаются только лоты одного продавца.
+    """
+    n = len(lots)
+    parent = list(range(n))
+
+    # 1. Точные совпадения «скелета» названия склеиваем без MinHash
+    first_by_skeleton: dict[tuple, int] = {}
+    representatives: list[tuple[int, str, Optional[str]]] = []
+    for i, lot in enumerate(lots):
+        skeleton = normalize_title(lot.get("title", ""))
+        owner = lot.get("seller") if by_seller else None
+        key = (owner, skeleton)
+        if key in first_by_skeleton:
+            parent[i] = first_by_skeleton[key]
+        else:
+            first_by_skeleton[key] = i
+            representatives.append((i, skeleton, owner))
+
+    # 2. Уникальные скелеты — через MinHash + LSH
+    memo: dict[str, tuple] = {}
+    signatures: dict[int, tuple] = {}
+    buckets: dict[tuple, list[int]] = {}
+    for i, skeleton, owner in representatives:
+        if not skeleton:
+            continue
+        sig = signatures[i] = _signature(skeleton, memo)
+        for b in range(BANDS):
+            band = sig[b * _ROWS:(b + 1) * _ROWS]
+            buckets.setdefault((owner, b, band), []).append(i)
+
+    # Лот сравнивается не со всеми соседями по корзине, а с одним представителем каждого
+    # уже найденного в ней кластера: лоты одного шаблона склеиваются в первый же кластер,
+    # и работа остаётся около O(n · BANDS), даже если шаблон дал корзину на тысячи лотов
+    threshold = SIMILARITY * NUM_PERM
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        reps: dict[int, int] = {}  # корень кластера → лот-представитель
+        for i in members:
+            root = _find(parent, i)
+            if root in reps:
+                continue
+            sig = signatures[i]
+            rep_of_root = i
+            for r, rep in list(reps.items()):
+                if sum(1 for x, y in zip(sig, signatures[rep]) if x == y) < threshold:
+                    continue
+                del reps[r]
+                ra, rb = _find(parent, r), _find(parent, root)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+                root, rep_of_root = min(ra, rb), rep
+            reps[root] = rep_of_root
+
+    return [_find(parent, i) for i in range(n)]
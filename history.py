@@ -0,0 +1,493 @@
+"""
+FunPay Analytics — история анализов
+Сохраняет каждый анализ категории в SQLite и отдаёт временные ряды цен.
+"""
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional
+
+import urls
+
+logger = logging.getLogger("FunPayAnalyst")
+
+DB_PATH = os.environ.get("FUNPAY_HISTORY_DB", "funpay_history.db")
+# Сколько доверять записи «лот → продавец»: лоты редко меняют владельца, но удаляются
+OFFER_SELLER_TTL = int(os.environ.get("FUNPAY_OFFER_TTL", str(7 * 86400)))
+# Сколько дней хранить сырые снимки со всеми лотами (0 — бессрочно). Агрегаты rollups
+# не удаляются, поэтому часовой и дневной ряды остаются полными
+RAW_RETENTION_DAYS = float(os.environ.get("FUNPAY_HISTORY_RAW_DAYS", "7"))
+
+# Размер корзин для агрегатов (в секундах)
+_GRANULARITY = {"hour": 3600, "day": 86400}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    category       TEXT    NOT NULL,
+    currency       TEXT    NOT NULL,
+    ts             REAL    NOT NULL,
+    total_lots     INTEGER NOT NULL,
+    total_sellers  INTEGER NOT NULL,
+    online_sellers INTEGER NOT NULL,
+    price_min      REAL    NOT NULL,
+    price_max      REAL    NOT NULL,
+    price_avg      REAL    NOT NULL,
+    price_median   REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_cat_ts ON snapshots (category, currency, ts);
+
+CREATE TABLE IF NOT EXISTS snapshot_lots (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    seller      TEXT    NOT NULL,
+    title       TEXT    NOT NULL,
+    price       REAL    NOT NULL,
+    reviews     INTEGER NOT NULL,
+    online      INTEGER NOT NULL,
+    url         TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lots_snapshot ON snapshot_lots (snapshot_id);
+CREATE INDEX IF NOT EXISTS idx_lots_seller ON snapshot_lots (seller, snapshot_id);
+
+-- Почасовые и посуточные агрегаты обновляются при каждой записи,
+-- поэтому запрос временного ряда не сканирует сырые снимки
+CREATE TABLE IF NOT EXISTS rollups (
+    category     TEXT    NOT NULL,
+    currency     TEXT    NOT NULL,
+    granularity  TEXT    NOT NULL,
+    bucket       INTEGER NOT NULL,
+    samples      INTEGER NOT NULL,
+    sum_median   REAL    NOT NULL,
+    sum_avg      REAL    NOT NULL,
+    sum_lots     INTEGER NOT NULL,
+    sum_online   INTEGER NOT NULL,
+    price_min    REAL    NOT NULL,
+    price_max    REAL    NOT NULL,
+    PRIMARY KEY (category, currency, granularity, bucket)
+);
+
+-- Инвертированный индекс продавец → актуальные лоты во всех категориях.
+-- Первичный ключ начинается с seller, так что выборка по продавцу — O(результата)
+CREATE TABLE IF NOT EXISTS seller_lots (
+    seller     TEXT    NOT NULL,
+    seller_id  INTEGER,
+    category   TEXT    NOT NULL,
+    currency   TEXT    NOT NULL,
+    lot_key    TEXT    NOT NULL,
+    title      TEXT    NOT NULL,
+    price      REAL    NOT NULL,
+    reviews    INTEGER NOT NULL,
+    online     INTEGER NOT NULL,
+    url        TEXT    NOT NULL,
+    first_seen REAL    NOT NULL,
+    last_seen  REAL    NOT NULL,
+    PRIMARY KEY (seller, category, currency, lot_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_seller_lots_cat ON seller_lots (category, currency, last_seen);
+
+-- Владельцы лотов: заполняется каждым обходом категории, чтобы ссылку на лот
+-- превращать в ссылку на продавца без загрузки страницы лота
+CREATE TABLE IF NOT EXISTS offer_sellers (
+    kind      TEXT    NOT NULL,
+    offer_id  TEXT    NOT NULL,
+    seller_id INTEGER NOT NULL,
+    seen      REAL    NOT NULL,
+    PRIMARY KEY (kind, offer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_offer_sellers_seen ON offer_sellers (seen);
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+
+
+def _db() -> sqlite3.Connection:
+    """Ленивое подключение к базе (одно на процесс, доступ под _db_lock)."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA foreign_keys=ON")
+        _conn.executescript(_SCHEMA)
+        _migrate(_conn)
+    return _conn
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Доводит базу, созданную прежними версиями, до текущей схемы."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(seller_lots)")}
+    if "seller_id" not in columns:
+        # Старые строки получат id при следующем обходе своей категории
+        conn.execute("ALTER TABLE seller_lots ADD COLUMN seller_id INTEGER")
+    # Ники меняются, а id нет — выборка по id не должна сканировать таблицу
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_seller_lots_id ON seller_lots (seller_id, currency)")
+    conn.commit()
+
+
+def category_key(url: str) -> str:
+    """Приводит ссылку на категорию к короткому ключу вида 'lots/610'."""
+    m = re.search(r"/(lots|chips)/(\d+)", url)
+    if m:
+        return f"{m.group(1)}/{m.group(2)}"
+    if url.isdigit():
+        return f"lots/{url}"
+    return url.rstrip("/")
+
+
+def save_snapshot(category_url: str, currency: str, result: dict, ts: Optional[float] = None) -> int:
+    """Сохраняет результат analyze_category (агрегаты + все лоты). Возвращает id снимка."""
+    ts = ts or time.time()
+    cat = category_key(category_url)
+    lots = result.get("all_lots", [])
+
+    with _db_lock:
+        conn = _db()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO snapshots (category, currency, ts, total_lots, total_sellers, online_sellers, "
+                "price_min, price_max, price_avg, price_median) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cat, currency, ts,
+                 result.get("total_lots", 0), result.get("total_sellers", 0), result.get("online_sellers", 0),
+                 result.get("price_min", 0), result.get("price_max", 0),
+                 result.get("price_avg", 0), result.get("price_median", 0)),
+            )
+            snapshot_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO snapshot_lots (snapshot_id, seller, title, price, reviews, online, url) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(snapshot_id, l["seller"], l["title"], l["price"], l["reviews"], int(l["online"]), l["url"])
+                 for l in lots],
+            )
+            _index_seller_lots(conn, cat, currency, lots, ts)
+            for granularity, size in _GRANULARITY.items():
+                bucket = int(ts // size * size)
+                conn.execute(
+                    "INSERT INTO rollups (category, currency, granularity, bucket, samples, sum_median, sum_avg, "
+                    "sum_lots, sum_online, price_min, price_max) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (category, currency, granularity, bucket) DO UPDATE SET "
+                    "samples = samples + 1, "
+                    "sum_median = sum_median + excluded.sum_median, "
+                    "sum_avg = sum_avg + excluded.sum_avg, "
+                    "sum_lots = sum_lots + excluded.sum_lots, "
+                    "sum_online = sum_online + excluded.sum_online, "
+                    "price_min = MIN(price_min, excluded.price_min), "
+                    "price_max = MAX(price_max, excluded.price_max)",
+                    (cat, currency, granularity, bucket,
+                     result.get("price_median", 0), result.get("price_avg", 0),
+                     result.get("total_lots", 0), result.get("online_sellers", 0),
+                     result.get("price_min", 0), result.get("price_max", 0)),
+                )
+            if RAW_RETENTION_DAYS > 0:
+                _prune_snapshots(conn, cat, currency, ts - RAW_RETENTION_DAYS * 86400)
+
+    logger.info(f"[History] Снимок {snapshot_id}: {cat} {currency}, {len(lots)} лотов")
+    return snapshot_id
+
+
+def _prune_snapshots(conn: sqlite3.Connection, cat: str, currency: str, before: float) -> None:
+    """
+    Удаляет сырые снимки категории старше before вместе с их лотами (ON DELETE CASCADE).
+    Два последних снимка остаются всегда — их сравнивает /api/diff.
+    """
+    conn.execute(
+        "DELETE FROM snapshots WHERE category = ? AND currency = ? AND ts < ? AND id NOT IN "
+        "(SELECT id FROM snapshots WHERE category = ? AND currency = ? ORDER BY ts DESC LIMIT 2)",
+        (cat, currency, before, cat, currency),
+    )
+
+
+def _index_seller_lots(conn: sqlite3.Connection, cat: str, currency: str, lots: list[dict], ts: float) -> None:
+    """
+    Инкрементально обновляет индекс продавцов по свежему обходу категории:
+    новые лоты добавляются, известные обновляются, пропавшие из категории удаляются.
+    """
+    conn.executemany(
+        "INSERT INTO seller_lots (seller, seller_id, category, currency, lot_key, title, price, reviews, online, "
+        "url, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (seller, category, currency, lot_key) DO UPDATE SET "
+        "seller_id = COALESCE(excluded.seller_id, seller_id), "
+        "title = excluded.title, price = excluded.price, reviews = excluded.reviews, "
+        "online = excluded.online, url = excluded.url, last_seen = excluded.last_seen",
+        [(l["seller"], l.get("seller_id"), cat, currency, lot_key(l["url"]), l["title"], l["price"], l["reviews"],
+          int(l["online"]), l["url"], ts, ts) for l in lots],
+    )
+    conn.execute(
+        "DELETE FROM seller_lots WHERE category = ? AND currency = ? AND last_seen < ?",
+        (cat, currency, ts),
+    )
+
+
+def remember_offer_sellers(lots: list[dict], ts: Optional[float] = None) -> None:
+    """Запоминает владельцев лотов из обхода категории (лоты без seller_id пропускаются)."""
+    ts = ts or time.time()
+    rows = []
+    for l in lots:
+        target = urls.parse(l["url"]) if l.get("seller_id") else None
+        if target and target.is_offer:
+            rows.append((target.kind, target.id, l["seller_id"], ts))
+    if not rows:
+        return
+    with _db_lock:
+        conn = _db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO offer_sellers (kind, offer_id, seller_id, seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, offer_id) DO UPDATE SET seller_id = excluded.seller_id, seen = excluded.seen",
+                rows,
+            )
+            conn.execute("DELETE FROM offer_sellers WHERE seen < ?", (ts - OFFER_SELLER_TTL,))
+
+
+def offer_seller(offer_url: str) -> Optional[int]:
+    """id продавца лота, если лот встречался в обходах не раньше OFFER_SELLER_TTL назад."""
+    target = urls.parse(offer_url)
+    if not target or not target.is_offer:
+        return None
+    with _db_lock:
+        row = _db().execute(
+            "SELECT seller_id FROM offer_sellers WHERE kind = ? AND offer_id = ? AND seen >= ?",
+            (target.kind, target.id, time.time() - OFFER_SELLER_TTL),
+        ).fetchone()
+    return row["seller_id"] if row else None
+
+
+def get_seller_footprint(seller: Optional[str] = None, currency: str = "RUB",
+                         seller_id: Optional[int] = None) -> dict:
+    """
+    Все известные лоты продавца во всех обойдённых категориях
+    и его ценовое позиционирование относительно медианы каждой категории.
+    Продавца ищут по нику seller или по seller_id — id переживает смену ника.
+    """
+    column, value = ("seller_id", seller_id) if seller_id is not None else ("seller", seller)
+    with _db_lock:
+        conn = _db()
+        rows = conn.execute(
+            "SELECT seller, seller_id, category, title, price, reviews, online, url, first_seen, last_seen "
+            f"FROM seller_lots WHERE {column} = ? AND currency = ? ORDER BY category, price",
+            (value, currency),
+        ).fetchall()
+        medians = {}
+        for cat in {r["category"] for r in rows}:
+            latest = conn.execute(
+                "SELECT price_median, total_lots FROM snapshots WHERE category = ? AND currency = ? "
+                "ORDER BY ts DESC LIMIT 1",
+                (cat, currency),
+            ).fetchone()
+            if latest:
+                medians[cat] = (latest["price_median"], latest["total_lots"])
+
+    categories: dict[str, dict] = {}
+    for r in rows:
+        cat = r["category"]
+        if cat not in categories:
+            median, total = medians.get(cat, (0, 0))
+            categories[cat] = {
+                "category":        cat,
+                "category_median": median,
+                "category_lots":   total,
+                "lots":            [],
+            }
+        categories[cat]["lots"].append({
+            "title":      r["title"],
+            "price":      r["price"],
+            "online":     bool(r["online"]),
+            "url":        r["url"],
+            "first_seen": r["first_seen"],
+            "last_seen":  r["last_seen"],
+        })
+
+    for c in categories.values():
+        prices = [l["price"] for l in c["lots"] if l["price"] > 0]
+        c["lots_count"] = len(c["lots"])
+        c["min_price"] = round(min(prices), 2) if prices else 0
+        c["max_price"] = round(max(prices), 2) if prices else 0
+        c["avg_price"] = round(sum(prices) / len(prices), 2) if prices else 0
+        # >1 — продавец дороже рынка, <1 — дешевле
+        c["price_vs_median"] = round(c["avg_price"] / c["category_median"], 2) if c["category_median"] else None
+        c["share_of_category"] = round(c["lots_count"] / c["category_lots"] * 100, 1) if c["category_lots"] else None
+
+    # По id ник берётся из самого свежего лота, по нику — id из любого лота, где он известен
+    latest = max(rows, key=lambda r: r["last_seen"], default=None)
+    return {
+        "seller":     latest["seller"] if latest and seller_id is not None else seller,
+        "seller_id":  seller_id if seller_id is not None else next(
+            (r["seller_id"] for r in rows if r["seller_id"] is not None), None),
+        "currency":   currency,
+        "total_lots": len(rows),
+        "reviews":    max((r["reviews"] for r in rows), default=0),
+        "categories": sorted(categories.values(), key=lambda c: c["lots_count"], reverse=True),
+    }
+
+
+def get_timeseries(category_url: str, currency: str = "RUB", granularity: str = "day",
+                   since: Optional[float] = None, until: Optional[float] = None) -> list[dict]:
+    """
+    Временной ряд медианы/средней цены, кол-ва лотов и продавцов онлайн.
+    granularity: 'raw' (каждый снимок), 'hour' или 'day'.
+    """
+    cat = category_key(category_url)
+    since = since or 0
+    until = until or time.time()
+
+    with _db_lock:
+        conn = _db()
+        if granularity == "raw":
+            rows = conn.execute(
+                "SELECT ts, price_median, price_avg, total_lots, online_sellers, price_min, price_max "
+                "FROM snapshots WHERE category = ? AND currency = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (cat, currency, since, until),
+            ).fetchall()
+            return [{
+                "ts":             r["ts"],
+                "price_median":   r["price_median"],
+                "price_avg":      r["price_avg"],
+                "total_lots":     r["total_lots"],
+                "online_sellers": r["online_sellers"],
+                "price_min":      r["price_min"],
+                "price_max":      r["price_max"],
+                "samples":        1,
+            } for r in rows]
+
+        if granularity not in _GRANULARITY:
+            raise ValueError(f"Неизвестная гранулярность: {granularity}")
+        rows = conn.execute(
+            "SELECT * FROM rollups WHERE category = ? AND currency = ? AND granularity = ? "
+            "AND bucket BETWEEN ? AND ? ORDER BY bucket",
+            (cat, currency, granularity, int(since // _GRANULARITY[granularity] * _GRANULARITY[granularity]), until),
+        ).fetchall()
+
+    return [{
+        "ts":             r["bucket"],
+        "price_median":   round(r["sum_median"] / r["samples"], 2),
+        "price_avg":      round(r["sum_avg"] / r["samples"], 2),
+        "total_lots":     round(r["sum_lots"] / r["samples"]),
+        "online_sellers": round(r["sum_online"] / r["samples"]),
+        "price_min":      r["price_min"],
+        "price_max":      r["price_max"],
+        "samples":        r["samples"],
+    } for r in rows]
+
+
+def list_snapshots(category_url: str, currency: str = "RUB", limit: int = 50) -> list[dict]:
+    """Последние снимки категории (без лотов), от новых к старым."""
+    cat = category_key(category_url)
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT id, ts, total_lots, total_sellers, online_sellers, price_median "
+            "FROM snapshots WHERE category = ? AND currency = ? ORDER BY ts DESC LIMIT ?",
+            (cat, currency, limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def lot_key(url: str) -> str:
+    """Ключ лота для сравнения снимков: id оффера целиком (у валют он с дефисами), иначе сама ссылка."""
+    target = urls.parse(url)
+    return target.id if target and target.is_offer else url
+
+
+def load_snapshot_lots(snapshot_id: int) -> list[dict]:
+    """Все лоты снимка."""
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT seller, title, price, reviews, online, url FROM snapshot_lots WHERE snapshot_id = ?",
+            (snapshot_id,),
+        ).fetchall()
+    return [{**dict(r), "online": bool(r["online"])} for r in rows]
+
+
+def diff_lots(old_lots: list[dict], new_lots: list[dict]) -> dict:
+    """
+    Сравнивает два набора лотов одной категории.
+    Хэш-соединение по id оффера: O(n + m) независимо от порядка лотов.
+    """
+    old_by_key = {lot_key(l["url"]): l for l in old_lots}
+    new_by_key = {lot_key(l["url"]): l for l in new_lots}
+
+    added = [l for k, l in new_by_key.items() if k not in old_by_key]
+    removed = [l for k, l in old_by_key.items() if k not in new_by_key]
+    repriced = []
+    for k, new in new_by_key.items():
+        old = old_by_key.get(k)
+        if old is not None and old["price"] != new["price"]:
+            repriced.append({
+                **new,
+                "old_price":  old["price"],
+                "change":     round(new["price"] - old["price"], 2),
+                "change_pct": round((new["price"] - old["price"]) / old["price"] * 100, 1) if old["price"] else None,
+            })
+    repriced.sort(key=lambda x: abs(x["change"]), reverse=True)
+
+    # Продавец онлайн, если онлайн хотя бы на одном его лоте
+    def _online_map(lots: list[dict]) -> dict[str, bool]:
+        status: dict[str, bool] = {}
+        for l in lots:
+            status[l["seller"]] = status.get(l["seller"], False) or l["online"]
+        return status
+
+    old_online = _online_map(old_lots)
+    new_online = _online_map(new_lots)
+    went_online = sorted(s for s, on in new_online.items() if on and not old_online.get(s, False))
+    went_offline = sorted(s for s, on in old_online.items() if on and not new_online.get(s, False))
+
+    return {
+        "added":        added,
+        "removed":      removed,
+        "repriced":     repriced,
+        "went_online":  went_online,
+        "went_offline": went_offline,
+        "summary": {
+            "added":        len(added),
+            "removed":      len(removed),
+            "repriced":     len(repriced),
+            "went_online":  len(went_online),
+            "went_offline": len(went_offline),
+        },
+    }
+
+
+def diff_snapshots(category_url: str, currency: str = "RUB",
+                   old_id: Optional[int] = None, new_id: Optional[int] = None) -> dict:
+    """
+    Разница между двумя снимками категории.
+    Без явных id сравнивает два последних снимка.
+    """
+    if old_id is None or new_id is None:
+        recent = list_snapshots(category_url, currency, limit=2)
+        if len(recent) < 2:
+            return {"error": "Для сравнения нужно минимум два снимка категории"}
+        new_id = new_id or recent[0]["id"]
+        old_id = old_id or recent[1]["id"]
+
+    cat = category_key(category_url)
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT id, ts FROM snapshots WHERE id IN (?, ?) AND category = ? AND currency = ?",
+            (old_id, new_id, cat, currency),
+        ).fetchall()
+    ts_by_id = {r["id"]: r["ts"] for r in rows}
+    if old_id not in ts_by_id or new_id not in ts_by_id:
+        return {"error": "Снимок не найден для этой категории"}
+
+    result = diff_lots(load_snapshot_lots(old_id), load_snapshot_lots(new_id))
+    result.update({
+        "category": cat,
+        "currency": currency,
+        "from":     {"id": old_id, "ts": ts_by_id[old_id]},
+        "to":       {"id": new_id, "ts": ts_by_id[new_id]},
+    })
+    return result
+
+
+def iter_current_lots():
+    """Актуальные лоты всех категорий из индекса продавцов (для прогрева поиска)."""
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT seller, category, currency, title, price, reviews, online, url FROM seller_lots"
+        ).fetchall()
+    for r in rows:
+        yield {**dict(r), "online": bool(r["online"])}
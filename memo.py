@@ -0,0 +1,138 @@
+"""
+FunPay Analytics — мемоизация разбора страниц
+Ключ — хэш тела ответа, имени и версии экстрактора и его аргументов. Пока страница
+не изменилась, повторный анализ стоит одного хэширования вместо разбора BeautifulSoup.
+В памяти держится LRU из MEMO_SIZE записей, на диске (если задан MEMO_DIR) — до
+MEMO_DISK_FILES файлов. Записи хранятся в pickle: каждый вызов получает свою копию,
+и дальнейшие правки лотов (cluster_id, outlier) не портят сохранённый результат.
+"""
+import os
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger("FunPayAnalyst")
+
+MEMO_SIZE = int(os.environ.get("FUNPAY_MEMO_SIZE", "512"))
+MEMO_DIR = os.environ.get("FUNPAY_MEMO_DIR", "")
+MEMO_DISK_FILES = int(os.environ.get("FUNPAY_MEMO_DISK_FILES", "5000"))
+
+_MISSING = object()
+_lru: "OrderedDict[str, bytes]" = OrderedDict()
+_lock = threading.Lock()
+_disk_writes = 0
+
+
+def key(extractor: str, version: int, body: bytes, args: tuple = ()) -> str:
+    """Ключ записи: хэш тела страницы вместе с экстрактором, его версией и аргументами."""
+    h = hashlib.blake2b(body, digest_size=20)
+    h.update(f"\0{extractor}\0{version}\0{args!r}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _disk_path(k: str) -> str:
+    return os.path.join(MEMO_DIR, k[:2], k + ".pkl")
+
+
+def _remember(k: str, blob: bytes) -> None:
+    with _lock:
+        _lru[k] = blob
+        _lru.move_to_end(k)
+        while len(_lru) > MEMO_SIZE:
+            _lru.popitem(last=False)
+
+
+def get(k: str):
+    """Сохранённый результат разбора или _MISSING."""
+    with _lock:
+        blob = _lru.get(k)
+        if blob is not None:
+            _lru.move_to_end(k)
+    if blob is not None:
+        metrics.PARSE_MEMO.inc(result="memory")
+        return pickle.loads(blob)
+    if MEMO_DIR:
+        try:
+            with open(_disk_path(k), "rb") as f:
+                blob = f.read()
+            value = pickle.loads(blob)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[Memo] Повреждённая запись {k}: {e}")
+        else:
+            _remember(k, blob)
+            metrics.PARSE_MEMO.inc(result="disk")
+            return value
+    metrics.PARSE_MEMO.inc(result="miss")
+    return _MISSING
+
+
+def put(k: str, value) -> None:
+    """Сохраняет результат разбора в памяти и, если включено, на диске."""
+    global _disk_writes
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    _remember(k, blob)
+    if not MEMO_DIR:
+        return
+    path = _disk_path(k)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"[Memo] Не удалось записать {path}: {e}")
+        return
+    with _lock:
+        _disk_writes += 1
+        prune = _disk_writes % 100 == 0
+    if prune:
+        _prune_disk()
+
+
+def _prune_disk() -> None:
+    """Удаляет самые старые файлы, если их больше MEMO_DISK_FILES."""
+    files = []
+    for root, _, names in os.walk(MEMO_DIR):
+        for name in names:
+            if name.endswith(".pkl"):
+                path = os.path.join(root, name)
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+    if len(files) <= MEMO_DISK_FILES:
+        return
+    files.sort()
+    for _, path in files[:len(files) - MEMO_DISK_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def clear(disk: bool = False) -> None:
+    """Очищает память (и диск, если disk=True)."""
+    with _lock:
+        _lru.clear()
+    if disk and MEMO_DIR:
+        for root, _, names in os.walk(MEMO_DIR):
+            for name in names:
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(root, name))
+
+
+def memoized(extractor, version: int, body: bytes, args: tuple, compute):
+    """Результат extractor для тела body: из мемо или compute() с сохранением."""
+    k = key(extractor.__name__, version, body, args)
+    value = get(k)
+    if value is _MISSING:
+        value = compute()
+        put(k, value)
+    return value
@@ -0,0 +1,155 @@
+"""
+FunPay Analytics — метрики в формате Prometheus
+Счётчики, гейджи и гистограммы с метками без внешних зависимостей.
+Обновление метрики — один захват лока и сложение, на пути запроса это незаметно.
+"""
+import bisect
+import threading
+
+_REGISTRY: list = []
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(k, (list(c), s, n)) for k, (c, s, n) in self._values.items()]
+        lines = self._header()
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, key, le)} {n}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, key)} {n}")
+        return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus (version 0.0.4)."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def target_type(url: str) -> str:
+    """Тип цели по ссылке: category, seller, offer или other."""
+    if "/users/" in url:
+        return "seller"
+    if "/lots/offer" in url or "?id=" in url:
+        return "offer"
+    if "/lots/" in url or "/chips/" in url:
+        return "category"
+    return "other"
+
+
+# ── Парсер ──
+PAGES_FETCHED = Counter("funpay_pages_fetched_total", "Страницы, успешно загруженные с FunPay",
+                        ("target", "currency"))
+FETCH_RETRIES = Counter("funpay_fetch_retries_total", "Неудачные попытки загрузки страницы по причинам",
+                        ("target", "currency", "reason"))
+FETCH_FAILURES = Counter("funpay_fetch_failures_total", "Страницы, которые не удалось загрузить, по причинам",
+                         ("target", "currency", "reason"))
+FETCH_SECONDS = Histogram("funpay_fetch_duration_seconds", "Время загрузки и парсинга одной страницы",
+                          ("target",))
+FETCH_DEADLINE = Counter("funpay_fetch_deadline_skips_total", "Страницы, не загруженные из-за исчерпанного бюджета времени",
+                         ("target",))
+PARSE_MEMO = Counter("funpay_parse_memo_total", "Разбор страниц: попадания в memo (memory, disk) и промахи",
+                     ("result",))
+OFFER_RESOLVE = Counter("funpay_offer_resolve_total",
+                        "Поиск продавца по ссылке на лот: из карты лотов (map), загрузкой страницы (fetch), неудачно (miss)",
+                        ("result",))
+
+# ── Очередь скрейпов ──
+SCHEDULER_QUEUED = Gauge("funpay_scheduler_queued", "Задачи, ждущие места в очереди скрейпов")
+SCHEDULER_WAIT = Histogram("funpay_scheduler_wait_seconds", "Время ожидания задачи в очереди скрейпов")
+SCHEDULER_REJECTED = Counter("funpay_scheduler_rejected_total", "Задачи, отклонённые по квоте (quota) или лимиту очереди (queue)",
+                             ("reason",))
+
+# ── Кэш и анализы ──
+CACHE_REQUESTS = Counter("funpay_cache_requests_total", "Обращения к кэшу анализов: hit, warm (из снимка на диске), miss",
+                         ("result",))
+ANALYSES_IN_FLIGHT = Gauge("funpay_analyses_in_flight", "Анализы, выполняемые прямо сейчас", ("target",))
+ANALYSIS_SECONDS = Histogram("funpay_analysis_duration_seconds", "Длительность анализа",
+                             ("target", "currency"))
+
+# ── HTTP API ──
+HTTP_REQUESTS = Counter("funpay_http_requests_total", "Запросы к API", ("endpoint", "method", "status"))
+HTTP_SECONDS = Histogram("funpay_http_request_duration_seconds", "Время ответа API", ("endpoint",))
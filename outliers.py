@@ -0,0 +1,67 @@
+"""
+FunPay Analytics — выбросы цен
+Робастная разметка мусорных цен (0.01, 999999) по медиане и MAD в log-шкале,
+с запасным правилом IQR, когда MAD вырождается.
+"""
+import math
+from typing import Optional
+
+MAD_THRESHOLD = 3.5        # порог модифицированного z-score
+IQR_FACTOR = 3.0           # множитель IQR для запасного правила
+MIN_SELLER_LOTS = 5        # меньше лотов — у продавца выбросы не ищем
+
+
+def _quantile(sorted_vals: list[float], q: float) -> float:
+    """Квантиль с линейной интерполяцией по отсортированному массиву."""
+    pos = (len(sorted_vals) - 1) * q
+    i = int(pos)
+    frac = pos - i
+    if i + 1 < len(sorted_vals):
+        return sorted_vals[i] + (sorted_vals[i + 1] - sorted_vals[i]) * frac
+    return sorted_vals[i]
+
+
+def _bounds(log_prices: list[float]) -> Optional[tuple[float, float]]:
+    """Допустимый диапазон log-цены или None, если данных мало."""
+    if len(log_prices) < 3:
+        return None
+    vals = sorted(log_prices)
+    median = _quantile(vals, 0.5)
+    mad = _quantile(sorted(abs(v - median) for v in vals), 0.5)
+    if mad > 0:
+        spread = MAD_THRESHOLD * 1.4826 * mad
+        return median - spread, median + spread
+    q1, q3 = _quantile(vals, 0.25), _quantile(vals, 0.75)
+    iqr = q3 - q1
+    if iqr > 0:
+        return q1 - IQR_FACTOR * iqr, q3 + IQR_FACTOR * iqr
+    # Больше половины цен одинаковые — выбросом считаем отклонение больше чем в e раз
+    return median - 1, median + 1
+
+
+def flag_outliers(lots: list[dict]) -> None:
+    """
+    Проставляет каждому лоту:
+    - outlier: цена выбивается из распределения категории (или не больше нуля);
+    - seller_outlier: цена выбивается из цен самого продавца.
+    Один проход по столбцу цен + сортировки, O(n log n).
+    """
+    logs = [math.log(l["price"]) if l["price"] > 0 else None for l in lots]
+    bounds = _bounds([v for v in logs if v is not None])
+
+    by_seller: dict[str, list[int]] = {}
+    for i, lot in enumerate(lots):
+        by_seller.setdefault(lot["seller"], []).append(i)
+        v = logs[i]
+        lot["outlier"] = v is None or (bounds is not None and not bounds[0] <= v <= bounds[1])
+        lot["seller_outlier"] = False
+
+    for idx in by_seller.values():
+        if len(idx) < MIN_SELLER_LOTS:
+            continue
+        seller_bounds = _bounds([logs[i] for i in idx if logs[i] is not None])
+        if seller_bounds is None:
+            continue
+        for i in idx:
+            v = logs[i]
+            lots[i]["seller_outlier"] = v is not None and not seller_bounds[0] <= v <= seller_bounds[1]
@@ -4,13 +4,32 @@ FunPay Analytics Parser
 """
 import requests
 from bs4 import BeautifulSoup
+import os
 import time
+import queue
+import threading
 import random
 import logging
 import datetime
+import multiprocessing
+import email.utils
 from typing import Optional
+from urllib.parse import urlparse
 import re
-from collections import Counter
+import math
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import dedup
+import memo
+import metrics
+import outliers
+import profiling
+import urls
+from urls import BASE_URL
 
 logger = logging.getLogger("FunPayAnalyst")
 
@@ -20,9 +39,70 @@ HEADERS = {
     "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
 }
-BASE_URL = "https://funpay.com"
-SESSION = requests.Session()
-SESSION.headers.update(HEADERS)
+COOKIE_DOMAIN = urlparse(BASE_URL).hostname
+
+# Вежливая пауза перед запросом (секунды)
+POLITE_DELAY = (0.8, 2.0)
+# Повторы временных ошибок: пауза BACKOFF_BASE·2ⁿ со случайным разбросом, не больше BACKOFF_MAX;
+# Retry-After от сервера соблюдается, но не дольше RETRY_AFTER_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRY_AFTER_MAX = 60.0
+
+# Глобальный бюджет одновременных запросов к FunPay на весь процесс:
+# его делят между собой запросы пользователей и фоновые задачи
+MAX_CONCURRENT_FETCHES = int(os.environ.get("FUNPAY_MAX_FETCHES", "4"))
+_fetch_budget = threading.BoundedSemaphore(MAX_CONCURRENT_FETCHES)
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    return session
+
+
+# Общий пул сессий: requests.Session не потокобезопасна, поэтому запрос берёт сессию
+# из пула на время session.get, а keep-alive соединения к FunPay переживают потоки
+# запросов Flask и одноразовые ThreadPoolExecutor. Запросов одновременно не больше
+# _fetch_budget, так что сессии в пуле хватает всегда. LIFO: первой выдаётся недавно
+# вернувшаяся сессия, у которой соединение ещё открыто
+SESSIONS = tuple(_new_session() for _ in range(MAX_CONCURRENT_FETCHES))
+SESSION = SESSIONS[0]
+_sessions: "queue.LifoQueue[requests.Session]" = queue.LifoQueue()
+for _s in SESSIONS:
+    _sessions.put(_s)
+
+# Причина последней неудачной загрузки — своя у каждого потока
+_local = threading.local()
+
+# Разбор HTML в отдельных процессах, чтобы потоки Flask не делили GIL на BeautifulSoup.
+# 0 — разбирать в потоке, который загрузил страницу
+PARSE_WORKERS = int(os.environ.get("FUNPAY_PARSE_WORKERS", "0"))
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Профили продавцов для обогащения top_sellers: рейтинг и число отзывов меняются медленно
+PROFILE_TTL = int(os.environ.get("FUNPAY_PROFILE_TTL", "1800"))
+PROFILE_CACHE_SIZE = int(os.environ.get("FUNPAY_PROFILE_CACHE_SIZE", "5000"))
+# id продавца → (ts, {"rating", "total_reviews", "lots_count"}) — только то, что читает обогащение
+_profiles: "OrderedDict[int, tuple[float, dict]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+# Подробности лотов со страниц /lots/offer: кэш на OFFER_DETAILS_TTL, не больше OFFER_DETAILS_SIZE лотов.
+# Обход, оборванный бюджетом времени, при следующем запросе продолжается с незагруженных лотов
+OFFER_DETAILS_TTL = int(os.environ.get("FUNPAY_OFFER_DETAILS_TTL", "3600"))
+OFFER_DETAILS_SIZE = int(os.environ.get("FUNPAY_OFFER_DETAILS_SIZE", "20000"))
+_offer_details: "OrderedDict[tuple[str, str], tuple[float, dict]]" = OrderedDict()
+_offer_details_lock = threading.Lock()
+
+# Версия экстракторов страниц: увеличивать при любом изменении _extract_*,
+# иначе memo будет отдавать результаты старого разбора
+EXTRACTOR_VERSION = 2
+
+
+# Поиск рыночных ниш
+NICHE_RESOLUTION = 12     # число ценовых корзин
+NICHE_MIN_GAP = 1.3       # разрыв между соседними ценами (во сколько раз), считающийся нишей
 
 # Словари для нормализации дат
 _MONTHS_RU = {
@@ -36,21 +116,224 @@ _MONTHS_SHORT = {
 }
 
 
-def _get(url: str, retries: int = 3, currency: str = "RUB") -> Optional[BeautifulSoup]:
+def _parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов для разбора HTML (создаётся при первом обращении) или None, если он выключен."""
+    global _pool
+    if PARSE_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Пул создаётся из потока запроса, пока другие потоки (watchlist, курсы, снимки кэша)
+            # могут держать блокировки; fork скопировал бы их захваченными. forkserver/spawn
+            # запускают чистые процессы (forkserver на Windows нет)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _offload(extractor, html: str, *args):
+    """
+    Выполняет extractor(html, *args) в пуле процессов, если он включён, иначе здесь же.
+    Экстракторы возвращают компактные записи (словари и списки), а не объекты BeautifulSoup.
+    """
+    global _pool
+    pool = _parse_pool()
+    if pool is None:
+        return extractor(html, *args)
+    try:
+        return pool.submit(extractor, html, *args).result()
+    except BrokenProcessPool:
+        logger.error("[Parser] Пул разбора HTML упал, пересоздаём его; страница разбирается в потоке")
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return extractor(html, *args)
+
+
+def _time_left(deadline: Optional[float], cap: Optional[float] = None) -> Optional[float]:
+    """Сколько можно ждать: cap, но не дольше, чем осталось до deadline (time.monotonic())."""
+    if deadline is None:
+        return cap
+    left = max(0.0, deadline - time.monotonic())
+    return left if cap is None else min(cap, left)
+
+
+def _expired(deadline: Optional[float]) -> bool:
+    """Бюджет времени исчерпан."""
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class _PageError(Exception):
+    """Ошибка разбора загруженной страницы — повторять запрос бессмысленно."""
+
+
+def _classify(exc: Exception) -> tuple[str, bool]:
+    """
+    Причина неудачи запроса и стоит ли его повторять:
+    404/410 — not_found, 403 — blocked, прочие 4xx — client_error (не повторяем);
+    429 — throttled, 5xx и 408 — server_error, таймауты и обрывы — network (повторяем).
+    """
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        if status in (404, 410):
+            return "not_found", False
+        if status == 403:
+            return "blocked", False
+        if status == 429:
+            return "throttled", True
+        if status >= 500 or status == 408:
+            return "server_error", True
+        return "client_error", False
+    if isinstance(exc, _PageError):
+        return "parse_error", False
+    # Таймауты, обрывы соединения и прочие сбои транспорта
+    return "network", True
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Пауза из заголовка Retry-After (секунды или HTTP-дата), если сервер её указал."""
+    response = getattr(exc, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _backoff(attempt: int) -> float:
+    """Экспоненциальная пауза перед повтором attempt (с 1) со случайным разбросом."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def _fail(url: str, reason: str, status: Optional[int] = None) -> None:
+    """Запоминает причину последней неудачной загрузки в текущем потоке."""
+    _local.failure = {"url": url, "reason": reason, "status": status}
+
+
+def last_failure() -> Optional[dict]:
+    """Причина последней неудачной загрузки в этом потоке: {"url", "reason", "status"} или None."""
+    return getattr(_local, "failure", None)
+
+
+def _fetch(url: str, parse, retries: int = 3, currency: str = "RUB", deadline: Optional[float] = None):
+    """
+    Загружает страницу и возвращает parse(response); None, если загрузить не удалось —
+    причина тогда доступна через last_failure().
+    Повторяются только временные ошибки (5xx, таймауты, обрывы, 429) — с экспоненциальной
+    паузой или паузой из Retry-After; 404, 403 и прочие 4xx сразу считаются окончательными.
+    С deadline паузы, ожидание в очереди и таймаут запроса урезаются до оставшегося времени,
+    а когда оно кончилось, новых попыток не делается.
+    """
+    target = metrics.target_type(url)
+    _local.failure = None
+    reason, status = "network", None
     for attempt in range(retries):
+        if _expired(deadline):
+            logger.warning(f"[Parser] Бюджет времени исчерпан, {url} не загружен")
+            metrics.FETCH_DEADLINE.inc(target=target)
+            _fail(url, "deadline")
+            return None
+        t_sleep = queue_wait = connect = transfer = 0.0
         try:
-            time.sleep(random.uniform(0.8, 2.0))  # вежливая задержка
-            # Явно выставляем куку валюты в сессии — перебивает любые Set-Cookie от сервера
-            SESSION.cookies.set("cy", currency, domain="funpay.com")
-            r = SESSION.get(url, timeout=15)
+            if attempt == 0:
+                t0 = time.perf_counter()
+                time.sleep(_time_left(deadline, random.uniform(*POLITE_DELAY)))  # вежливая задержка
+                t_sleep = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            if not _fetch_budget.acquire(timeout=_time_left(deadline)):
+                raise TimeoutError("бюджет времени исчерпан в очереди запросов")
+            session = _sessions.get()
+            try:
+                queue_wait = time.perf_counter() - t0
+                # Кука валюты выставляется при каждой выдаче сессии — перебивает и валюту
+                # прошлого запроса, и любые Set-Cookie от сервера
+                session.cookies.set("cy", currency, domain=COOKIE_DOMAIN)
+                t0 = time.perf_counter()
+                r = session.get(url, timeout=max(0.1, _time_left(deadline, 15)))
+                # elapsed — до получения заголовков, остальное — загрузка тела
+                connect = r.elapsed.total_seconds()
+                transfer = max(0.0, time.perf_counter() - t0 - connect)
+            finally:
+                _sessions.put(session)
+                _fetch_budget.release()
             r.raise_for_status()
-            return BeautifulSoup(r.text, "html.parser")
+            t0 = time.perf_counter()
+            try:
+                result = parse(r)
+            except Exception as e:
+                raise _PageError(f"ошибка разбора: {e}") from e
+            parse_t = time.perf_counter() - t0
+            profiling.record_fetch(url, attempt=attempt + 1, status=r.status_code, queue_wait=queue_wait,
+                                   sleep=t_sleep, connect=connect, transfer=transfer, parse=parse_t)
+            metrics.PAGES_FETCHED.inc(target=target, currency=currency)
+            metrics.FETCH_SECONDS.observe(connect + transfer + parse_t, target=target)
+            return result
         except Exception as e:
-            logger.warning(f"[Parser] Попытка {attempt+1}/{retries} для {url}: {e}")
-            time.sleep(3)
+            reason, retryable = _classify(e)
+            response = getattr(e, "response", None)
+            status = response.status_code if response is not None else None
+            logger.warning(f"[Parser] Попытка {attempt+1}/{retries} для {url} ({reason}): {e}")
+            metrics.FETCH_RETRIES.inc(target=target, currency=currency, reason=reason)
+            profiling.record_fetch(url, attempt=attempt + 1, error=str(e), reason=reason, status=status,
+                                   queue_wait=queue_wait, sleep=t_sleep, connect=connect, transfer=transfer)
+            if not retryable or attempt == retries - 1:
+                break
+            pause = _retry_after(e) if reason == "throttled" else None
+            if pause is None:
+                pause = _backoff(attempt + 1)
+            time.sleep(_time_left(deadline, min(pause, RETRY_AFTER_MAX)))
+    # Лимит запросов, не снятый и после повторов, для вызывающего — та же блокировка
+    if reason == "throttled":
+        reason = "blocked"
+    metrics.FETCH_FAILURES.inc(target=target, currency=currency, reason=reason)
+    _fail(url, reason, status)
     return None
 
 
+# Сообщения для пользователя по причине неудачи загрузки
+_FAILURE_MESSAGES = {
+    "not_found": "Страница не найдена на FunPay: она удалена или ссылка неверна",
+    "blocked":   "FunPay ограничил доступ (антифрод или лимит запросов), попробуйте позже",
+    "deadline":  "Не уложились в бюджет времени",
+}
+
+
+def _failure_result(default: str, **extra) -> dict:
+    """Результат-ошибка анализа с причиной последней неудачной загрузки (reason)."""
+    failure = last_failure()
+    reason = failure["reason"] if failure else "empty"
+    result = {"error": _FAILURE_MESSAGES.get(reason, default), "reason": reason, **extra}
+    if reason == "deadline":
+        result["partial"] = True
+    return result
+
+
+def _get(url: str, retries: int = 3, currency: str = "RUB",
+         deadline: Optional[float] = None) -> Optional[BeautifulSoup]:
+    """Загружает страницу и отдаёт её дерево BeautifulSoup (разбор всегда в текущем потоке)."""
+    return _fetch(url, lambda r: BeautifulSoup(r.text, "html.parser"), retries=retries, currency=currency,
+                  deadline=deadline)
+
+
+def _fetch_extract(url: str, extractor, *args, currency: str = "RUB", deadline: Optional[float] = None):
+    """
+    Загружает страницу и разбирает её экстрактором — в пуле процессов, если он включён.
+    Неизменившаяся страница не разбирается повторно: результат берётся из memo по хэшу тела.
+    """
+    def parse(r):
+        return memo.memoized(extractor, EXTRACTOR_VERSION, r.content, args,
+                             lambda: _offload(extractor, r.text, *args))
+    return _fetch(url, parse, currency=currency, deadline=deadline)
+
+
 def _parse_funpay_date_to_month(date_str: str) -> str:
     """Нормализует строку даты FunPay в формат 'Янв 2025'."""
     now = datetime.datetime.now()
@@ -79,6 +362,18 @@ def _parse_funpay_date_to_month(date_str: str) -> str:
     return date_str  # fallback — возвращаем как есть
 
 
+def sort_months(labels) -> list[str]:
+    """Месяцы вида 'Янв 2025' по порядку от старых к новым; нераспознанные — в конце."""
+    month_num = {v: k for k, v in _MONTHS_SHORT.items()}
+
+    def key(label: str) -> tuple[int, int]:
+        name, _, year = label.partition(" ")
+        if name in month_num and year.isdigit():
+            return int(year), month_num[name]
+        return 10_000, 0
+    return sorted(set(labels), key=key)
+
+
 def _parse_review_stars(rev_el) -> int:
     """Извлекает количество звёзд из элемента отзыва (класс ratingN)."""
     rating_container = rev_el.select_one(".review-item-rating, .review-item-user .rating")
@@ -112,81 +407,100 @@ def get_categories() -> list[dict]:
     return categories
 
 
+def _extract_category_page(html: str) -> dict:
+    """Лоты одной страницы категории и признак наличия следующей страницы."""
+    soup = BeautifulSoup(html, "html.parser")
+    lots = []
+    for offer in soup.select("a.tc-item"):
+        try:
+            seller_el  = offer.select_one(".media-user-name")
+            price_el   = offer.select_one(".tc-price")
+            reviews_el = offer.select_one(
+                ".media-user-reviews, .media-user-reviews-count, "
+                ".tc-reviews, .rating-mini-count, span[class*='review']"
+            )
+            title_el   = offer.select_one(".tc-desc-text, .tc-title")
+            online_el  = offer.select_one(".media-user-status.online, .online")
+            user_el    = offer.select_one("[data-href*='/users/']")
+
+            seller_raw = seller_el.get_text(separator=" ", strip=True) if seller_el else "Неизвестно"
+            seller = seller_raw.replace("Онлайн", "").replace("онлайн", "").strip()
+
+            price_raw = price_el.get_text(strip=True) if price_el else "0"
+            price_num = re.sub(r"[^\d.,]", "", price_raw).replace(",", ".")
+            try:
+                price = float(price_num) if price_num else 0.0
+            except ValueError:
+                price = 0.0
+
+            rev_raw = reviews_el.get_text(strip=True) if reviews_el else "0"
+            rev_num = re.sub(r"[^\d]", "", rev_raw)
+            reviews = int(rev_num) if rev_num else 0
+
+            title = title_el.get_text(strip=True) if title_el else ""
+            href = offer.get("href", "")
+            lot_url = href if href.startswith("http") else BASE_URL + href
+            seller_id_match = re.search(r"/users/(\d+)", user_el.get("data-href", "")) if user_el else None
+
+            lots.append({
+                "seller":  seller,
+                "title":   title,
+                "price":   price,
+                "reviews": reviews,
+                "online":  bool(online_el),
+                "url":     lot_url,
+                "seller_id": int(seller_id_match.group(1)) if seller_id_match else None,
+            })
+        except Exception as e:
+            logger.debug(f"Ошибка парсинга лота: {e}")
+            continue
+
+    next_btn = soup.select_one("a.pagination-next, a[rel='next'], li.next a")
+    return {"lots": lots, "has_next": bool(next_btn)}
+
+
 def get_lots_in_category(category_url: str, max_pages: int = 2, currency: str = "RUB") -> list[dict]:
     """
     Парсит лоты в категории с пагинацией.
     Возвращает список лотов с ценами, продавцами и кол-вом отзывов.
     """
+    return _collect_category(category_url, max_pages, currency)[0]
+
+
+def _collect_category(category_url: str, max_pages: int = 2, currency: str = "RUB",
+                      deadline: Optional[float] = None) -> tuple[list[dict], dict]:
+    """
+    Обходит страницы категории, пока хватает бюджета времени.
+    Возвращает лоты и покрытие: сколько страниц загружено и оборван ли обход по времени.
+    """
     lots = []
     base_url = category_url.rstrip("/").split("?")[0]
+    pages_fetched = 0
+    partial = False
 
     for page in range(1, max_pages + 1):
         page_url = base_url + "/" if page == 1 else f"{base_url}/?page={page}"
-        soup = _get(page_url, currency=currency)
-        if not soup:
+        extracted = _fetch_extract(page_url, _extract_category_page, currency=currency, deadline=deadline)
+        if not extracted:
+            partial = _expired(deadline)
             break
+        pages_fetched += 1
 
-        page_lots = []
-        for offer in soup.select("a.tc-item"):
-            try:
-                seller_el  = offer.select_one(".media-user-name")
-                price_el   = offer.select_one(".tc-price")
-                reviews_el = offer.select_one(
-                    ".media-user-reviews, .media-user-reviews-count, "
-                    ".tc-reviews, .rating-mini-count, span[class*='review']"
-                )
-                title_el   = offer.select_one(".tc-desc-text, .tc-title")
-                online_el  = offer.select_one(".media-user-status.online, .online")
-
-                seller_raw = seller_el.get_text(separator=" ", strip=True) if seller_el else "Неизвестно"
-                seller = seller_raw.replace("Онлайн", "").replace("онлайн", "").strip()
-
-                price_raw = price_el.get_text(strip=True) if price_el else "0"
-                price_num = re.sub(r"[^\d.,]", "", price_raw).replace(",", ".")
-                try:
-                    price = float(price_num) if price_num else 0.0
-                except ValueError:
-                    price = 0.0
-
-                rev_raw = reviews_el.get_text(strip=True) if reviews_el else "0"
-                rev_num = re.sub(r"[^\d]", "", rev_raw)
-                reviews = int(rev_num) if rev_num else 0
-
-                title = title_el.get_text(strip=True) if title_el else ""
-                href = offer.get("href", "")
-                lot_url = href if href.startswith("http") else BASE_URL + href
-
-                page_lots.append({
-                    "seller":  seller,
-                    "title":   title,
-                    "price":   price,
-                    "reviews": reviews,
-                    "online":  bool(online_el),
-                    "url":     lot_url,
-                })
-            except Exception as e:
-                logger.debug(f"Ошибка парсинга лота: {e}")
-                continue
-
+        page_lots = extracted["lots"]
         if not page_lots:
             break  # нет лотов — дальше не идём
         lots.extend(page_lots)
 
         # Проверяем наличие следующей страницы
-        next_btn = soup.select_one("a.pagination-next, a[rel='next'], li.next a")
-        if not next_btn and page > 1:
+        if not extracted["has_next"] and page > 1:
             break
 
-    return lots
-
+    return lots, {"pages_fetched": pages_fetched, "pages_max": max_pages, "partial": partial}
 
-def get_seller_profile(user_id: int, currency: str = "RUB") -> dict:
-    """Парсит профиль продавца."""
-    SESSION.cookies.set("cy", currency, domain="funpay.com")
-    soup = _get(f"{BASE_URL}/users/{user_id}/", currency=currency)
-    if not soup:
-        return {}
 
+def _extract_profile(html: str, user_id: int) -> dict:
+    """Поля профиля продавца и его активные лоты."""
+    soup = BeautifulSoup(html, "html.parser")
     result = {"user_id": user_id, "lots": [], "reviews_sample": []}
 
     # Имя продавца
@@ -257,12 +571,36 @@ def get_seller_profile(user_id: int, currency: str = "RUB") -> dict:
     return result
 
 
-def get_seller_reviews_paginated(user_id: int, currency: str = "RUB", max_reviews: int = 500) -> list:
+def get_seller_profile(user_id: int, currency: str = "RUB", deadline: Optional[float] = None) -> dict:
+    """Парсит профиль продавца."""
+    return _fetch_extract(f"{BASE_URL}/users/{user_id}/", _extract_profile, user_id,
+                          currency=currency, deadline=deadline) or {}
+
+
+def _extract_reviews(html: str) -> list[dict]:
+    """Отзывы одной страницы профиля: дата, текст, купленный товар и звёзды."""
+    soup = BeautifulSoup(html, "html.parser")
+    reviews = []
+    for rev in soup.select(".review-item"):
+        desc = rev.select_one(".review-item-detail, .review-item-desc, .review-item-title")
+        date_el = rev.select_one(".review-item-date")
+        text_el = rev.select_one(".review-item-text")
+        reviews.append({
+            "item":  desc.get_text(strip=True) if desc else None,
+            "date":  date_el.get_text(strip=True) if date_el else None,
+            "text":  text_el.get_text(strip=True) if text_el else None,
+            "stars": _parse_review_stars(rev),
+        })
+    return reviews
+
+
+def get_seller_reviews_paginated(user_id: int, currency: str = "RUB", max_reviews: int = 500,
+                                 deadline: Optional[float] = None) -> list:
     """
     Загружает отзывы продавца через skip-пагинацию (?skip=0, ?skip=25, ...).
-    Возвращает список сырых элементов BeautifulSoup (дедуплицированных).
+    Возвращает список записей отзывов (дедуплицированных).
+    С deadline останавливается, когда время вышло, и отдаёт уже собранное.
     """
-    SESSION.cookies.set("cy", currency, domain="funpay.com")
     all_reviews = []
     seen_keys = set()
     base = f"{BASE_URL}/users/{user_id}/"
@@ -272,23 +610,14 @@ def get_seller_reviews_paginated(user_id: int, currency: str = "RUB", max_review
     while len(all_reviews) < max_reviews:
         page += 1
         url = base if skip == 0 else f"{base}?skip={skip}"
-        soup = _get(url, currency=currency)
-        if not soup:
-            break
-
-        reviews = soup.select(".review-item")
+        reviews = _fetch_extract(url, _extract_reviews, currency=currency, deadline=deadline)
         if not reviews:
             break
 
         new_count = 0
         all_dupe = True
         for rev in reviews:
-            date_el = rev.select_one(".review-item-date")
-            text_el = rev.select_one(".review-item-text")
-            key = (
-                date_el.get_text(strip=True) if date_el else "",
-                (text_el.get_text(strip=True)[:50] if text_el else ""),
-            )
+            key = (rev["date"] or "", (rev["text"] or "")[:50])
             if key not in seen_keys:
                 seen_keys.add(key)
                 all_reviews.append(rev)
@@ -305,17 +634,204 @@ def get_seller_reviews_paginated(user_id: int, currency: str = "RUB", max_review
     return all_reviews
 
 
-def analyze_category(category_url: str, currency: str = "RUB") -> dict:
+def analyze_category(category_url: str, currency: str = "RUB", budget: Optional[float] = None) -> dict:
     """
     Полный анализ категории:
     - топ продавцов по кол-ву отзывов
     - распределение цен
     - онлайн-активность
     - рыночные возможности (ценовые ниши)
+    С budget (секунды) загрузка страниц прекращается, когда время вышло: анализ строится
+    по уже загруженным лотам и помечается partial=True.
     """
-    lots = get_lots_in_category(category_url, currency=currency)
+    deadline = time.monotonic() + budget if budget else None
+    lap = profiling.laps()
+    lots, coverage = _collect_category(category_url, currency=currency, deadline=deadline)
+    lap("fetch")
     if not lots:
-        return {"error": "Не удалось получить данные", "lots": []}
+        return _failure_result("Не удалось получить данные", lots=[])
+    return _summarize_category(lots, partial=coverage["partial"],
+                               coverage={"pages_fetched": coverage["pages_fetched"],
+                                         "pages_max": coverage["pages_max"]})
+
+
+# Заголовки .param-item страницы лота → поля подробностей (русская и английская версии сайта)
+_OFFER_PARAMS = {
+    "краткое описание":    "short_description",
+    "short description":   "short_description",
+    "подробное описание":  "description",
+    "detailed description": "description",
+    "наличие":             "stock",
+    "в наличии":           "stock",
+    "availability":        "stock",
+    "способ получения":    "delivery",
+    "получение":           "delivery",
+    "delivery":            "delivery",
+}
+DESCRIPTION_MAX = 2000
+
+
+def _extract_offer(html: str) -> dict:
+    """Подробности лота: описания, наличие, способ получения и автовыдача."""
+    soup = BeautifulSoup(html, "html.parser")
+    details = {"short_description": None, "description": None, "stock": None,
+               "delivery": None, "auto_delivery": False}
+    for item in soup.select(".param-item"):
+        head = item.select_one("h5")
+        value = head.find_next_sibling("div") if head else None
+        field = _OFFER_PARAMS.get(head.get_text(strip=True).lower()) if head else None
+        if not field or value is None:
+            continue
+        text = value.get_text(separator=" ", strip=True)
+        if field == "stock":
+            digits = re.sub(r"[^\d]", "", text)
+            details["stock"] = int(digits) if digits else None
+        else:
+            details[field] = text[:DESCRIPTION_MAX]
+    delivery = (details["delivery"] or "").lower()
+    details["auto_delivery"] = bool(soup.select_one(".auto-dlv-icon")) or "автомат" in delivery or "auto" in delivery
+    return details
+
+
+def _offer_details_get(key: tuple[str, str]) -> Optional[dict]:
+    with _offer_details_lock:
+        hit = _offer_details.get(key)
+        if hit and time.time() - hit[0] < OFFER_DETAILS_TTL:
+            _offer_details.move_to_end(key)
+            return hit[1]
+    return None
+
+
+def _offer_details_put(key: tuple[str, str], details: dict) -> None:
+    with _offer_details_lock:
+        _offer_details[key] = (time.time(), details)
+        _offer_details.move_to_end(key)
+        while len(_offer_details) > OFFER_DETAILS_SIZE:
+            _offer_details.popitem(last=False)
+
+
+def crawl_lot_details(result: dict, max_lots: int = 50, currency: str = "RUB",
+                      budget: Optional[float] = None) -> dict:
+    """
+    Дополняет первые max_lots лотов категории подробностями со страниц лотов (поле details).
+    Лоты дедуплицируются по id, страницы грузятся параллельно под общим _fetch_budget,
+    загруженное кэшируется на OFFER_DETAILS_TTL. Исходный result не меняется;
+    в ответе поле details_coverage: сколько лотов взято из кэша, загружено и не получено.
+    """
+    deadline = time.monotonic() + budget if budget else None
+    lots = [dict(l) for l in result.get("all_lots", [])]
+    # Порядок — как в категории; повторы одного лота загружаются один раз
+    wanted: dict[tuple[str, str], str] = {}
+    for lot in lots:
+        target = urls.parse(lot["url"])
+        if target and target.is_offer and len(wanted) < max_lots:
+            wanted.setdefault((target.kind, target.id), target.url)
+
+    found: dict[tuple[str, str], dict] = {}
+    missing = []
+    for key in wanted:
+        details = _offer_details_get(key)
+        if details is not None:
+            found[key] = details
+        else:
+            missing.append(key)
+    cached = len(found)
+
+    def _load(key: tuple[str, str]) -> Optional[dict]:
+        details = _fetch_extract(wanted[key], _extract_offer, currency=currency, deadline=deadline)
+        if details:
+            _offer_details_put(key, details)
+        return details
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), MAX_CONCURRENT_FETCHES)) as pool:
+            for key, details in zip(missing, pool.map(_load, missing)):
+                if details:
+                    found[key] = details
+
+    for lot in lots:
+        target = urls.parse(lot["url"])
+        details = found.get((target.kind, target.id)) if target else None
+        if details is not None:
+            lot["details"] = dict(details)
+
+    coverage = {"requested": len(wanted), "cached": cached, "fetched": len(found) - cached,
+                "failed": len(wanted) - len(found), "partial": _expired(deadline)}
+    return {**result, "all_lots": lots, "details_coverage": coverage,
+            "details_summary": _summarize_details(list(found.values()))}
+
+
+def _summarize_details(details: list[dict]) -> dict:
+    """Сводка по загруженным подробностям: доля автовыдачи и наличие."""
+    stock = sorted(d["stock"] for d in details if d.get("stock") is not None)
+    return {
+        "lots":               len(details),
+        "auto_delivery_share": round(sum(1 for d in details if d["auto_delivery"]) / len(details), 3) if details else 0,
+        "stock_median":       stock[len(stock) // 2] if stock else None,
+        "stock_total":        sum(stock),
+    }
+
+
+def _cached_profile(user_id: int, deadline: Optional[float] = None) -> tuple[Optional[dict], bool]:
+    """
+    Рейтинг, число отзывов и лотов продавца из кэша (не старше PROFILE_TTL) или с профиля;
+    второе значение — был ли в кэше. None, если профиль получить не удалось.
+    """
+    with _profiles_lock:
+        hit = _profiles.get(user_id)
+        if hit and time.time() - hit[0] < PROFILE_TTL:
+            _profiles.move_to_end(user_id)
+            return hit[1], True
+    profile = get_seller_profile(user_id, deadline=deadline)
+    if not profile:
+        return None, False
+    summary = {
+        "rating":        profile.get("rating", 0.0),
+        "total_reviews": profile.get("total_reviews", 0),
+        "lots_count":    len(profile.get("lots", [])),
+    }
+    with _profiles_lock:
+        _profiles[user_id] = (time.time(), summary)
+        _profiles.move_to_end(user_id)
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return summary, False
+
+
+def enrich_top_sellers(result: dict, top_n: int = 10, budget: Optional[float] = None) -> dict:
+    """
+    Дополняет первых top_n продавцов категории данными профиля: рейтингом, общим числом
+    отзывов и числом активных лотов. Профили грузятся параллельно, но под общим
+    _fetch_budget, и кэшируются на PROFILE_TTL. Исходный result не меняется.
+    """
+    deadline = time.monotonic() + budget if budget else None
+    sellers = [dict(s) for s in result.get("top_sellers", [])]
+    wanted = [s for s in sellers[:top_n] if s.get("seller_id")]
+    stats = {"requested": len(wanted), "fetched": 0, "cached": 0, "failed": 0}
+    if wanted:
+        with ThreadPoolExecutor(max_workers=min(len(wanted), MAX_CONCURRENT_FETCHES)) as pool:
+            profiles = list(pool.map(lambda s: _cached_profile(s["seller_id"], deadline), wanted))
+        for s, (profile, cached) in zip(wanted, profiles):
+            if not profile:
+                stats["failed"] += 1
+                continue
+            stats["cached" if cached else "fetched"] += 1
+            s["rating"] = profile["rating"]
+            s["total_reviews"] = profile["total_reviews"]
+            s["profile_lots"] = profile["lots_count"]
+    return {**result, "top_sellers": sellers, "enriched": stats}
+
+
+def _summarize_category(lots: list[dict], partial: bool = False, coverage: Optional[dict] = None) -> dict:
+    """Аналитика категории по загруженным лотам (лоты дополняются cluster_id и outlier)."""
+    lap = profiling.laps()
+    # Почти одинаковые лоты одного продавца (отличаются эмодзи или числами) — один кластер
+    for lot, cluster_id in zip(lots, dedup.cluster_lots(lots)):
+        lot["cluster_id"] = cluster_id
+    lap("dedup")
+    # Выбросы цен по категории и по каждому продавцу
+    outliers.flag_outliers(lots)
+    lap("outliers")
 
     # Агрегация по продавцам
     sellers: dict[str, dict] = {}
@@ -330,9 +846,12 @@ def analyze_category(category_url: str, currency: str = "RUB") -> dict:
                 "min_price":     lot["price"],
                 "max_price":     lot["price"],
                 "prices":        [],
+                "clusters":      set(),
                 "online":        lot["online"],
+                "seller_id":     lot.get("seller_id"),
             }
         sellers[s]["lots_count"] += 1
+        sellers[s]["clusters"].add(lot["cluster_id"])
         sellers[s]["prices"].append(lot["price"])
         if lot["price"] > 0:
             sellers[s]["min_price"] = min(sellers[s]["min_price"], lot["price"])
@@ -341,14 +860,31 @@ def analyze_category(category_url: str, currency: str = "RUB") -> dict:
     for s in sellers.values():
         valid = [p for p in s["prices"] if p > 0]
         s["avg_price"] = round(sum(valid) / len(valid), 2) if valid else 0
-        del s["prices"]
+        s["unique_lots_count"] = len(s["clusters"])
+        del s["prices"], s["clusters"]
 
     sellers_list = sorted(sellers.values(), key=lambda x: x["reviews"], reverse=True)
     prices = [l["price"] for l in lots if l["price"] > 0]
+    lap("aggregate")
 
     # Рыночные ниши: ценовые диапазоны с наименьшей конкуренцией
     buckets = _price_buckets(prices)
-    opportunity = _find_market_opportunities(buckets, prices)
+    opportunity = _find_market_opportunities(prices, [l["reviews"] for l in lots if l["price"] > 0])
+
+    # Те же показатели без дубликатов: кластер представлен самой низкой ценой
+    cluster_price: dict[int, tuple[float, int]] = {}
+    for lot in lots:
+        if lot["price"] > 0:
+            cid = lot["cluster_id"]
+            if cid not in cluster_price or lot["price"] < cluster_price[cid][0]:
+                cluster_price[cid] = (lot["price"], lot["reviews"])
+    dedup_prices = [p for p, _ in cluster_price.values()]
+    dedup_buckets = _price_buckets(dedup_prices)
+    unique_lots = len(set(l["cluster_id"] for l in lots))
+
+    # Статистика без выбросов считается рядом с «сырой»
+    clean_prices = sorted(l["price"] for l in lots if not l["outlier"])
+    lap("niches")
 
     return {
         "total_lots":     len(lots),
@@ -362,6 +898,25 @@ def analyze_category(category_url: str, currency: str = "RUB") -> dict:
         "all_lots":       lots,
         "price_buckets":  buckets,
         "market_opportunities": opportunity,
+        "outliers_count": sum(1 for l in lots if l["outlier"]),
+        "partial":        partial,
+        "coverage":       coverage,
+        "trimmed": {
+            "price_min":     round(clean_prices[0], 2) if clean_prices else 0,
+            "price_max":     round(clean_prices[-1], 2) if clean_prices else 0,
+            "price_avg":     round(sum(clean_prices) / len(clean_prices), 2) if clean_prices else 0,
+            "price_median":  round(clean_prices[len(clean_prices) // 2], 2) if clean_prices else 0,
+            "price_buckets": _price_buckets(clean_prices),
+        },
+        "dedup": {
+            "unique_lots":          unique_lots,
+            "duplicate_lots":       len(lots) - unique_lots,
+            "price_avg":            round(sum(dedup_prices) / len(dedup_prices), 2) if dedup_prices else 0,
+            "price_median":         round(sorted(dedup_prices)[len(dedup_prices) // 2], 2) if dedup_prices else 0,
+            "price_buckets":        dedup_buckets,
+            "market_opportunities": _find_market_opportunities(
+                dedup_prices, [r for _, r in cluster_price.values()]),
+        },
     }
 
 
@@ -384,31 +939,86 @@ def _price_buckets(prices: list[float], buckets: int = 8) -> list[dict]:
     return result
 
 
-def _find_market_opportunities(buckets: list[dict], prices: list[float]) -> list[dict]:
+def _find_market_opportunities(prices: list[float], reviews: Optional[list[int]] = None,
+                               resolution: int = NICHE_RESOLUTION, mode: str = "log", top: int = 3) -> list[dict]:
     """
     Находит ценовые ниши с наименьшей конкуренцией.
-    Возвращает топ-3 диапазона, где мало лотов (низкая конкуренция).
+    Цены сортируются один раз (O(n log n)), дальше всё считается по отсортированному массиву:
+    - «разрывы» — соседние цены, отличающиеся в NICHE_MIN_GAP и более раз (пустые ниши);
+    - «редкие зоны» — корзины (логарифмические или квантильные) с наименьшей плотностью
+      лотов на единицу log-цены, где каждый лот весит 1 + ln(1 + отзывы продавца).
+    Края распределения (2% с каждой стороны) не учитываются, чтобы мусорные цены не давали ложных ниш.
     """
-    if not buckets:
+    pairs = sorted((p, r) for p, r in zip(prices, reviews or [0] * len(prices)) if p > 0)
+    if not pairs:
         return []
-    max_count = max(b["count"] for b in buckets) or 1
-    # Ниши: непустые диапазоны с низкой конкуренцией
-    niches = [
-        {
-            "range":           b["range"],
-            "count":           b["count"],
-            "competition_pct": round(b["count"] / max_count * 100),
-            "recommended_price": round((b.get("lo", 0) + b.get("hi", 0)) / 2, 2),
-        }
-        for b in buckets
-        if b["count"] > 0
-    ]
-    # Сортируем по наименьшей конкуренции
-    niches.sort(key=lambda x: x["count"])
-    return niches[:3]
-
-
-def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_reviews: int = 500) -> dict:
+    sp = [p for p, _ in pairs]
+    n = len(sp)
+    if sp[0] == sp[-1]:
+        return [{"range": f"{sp[0]:.0f}", "count": n, "competition_pct": 100,
+                 "recommended_price": round(sp[0], 2), "lo": sp[0], "hi": sp[0], "kind": "sparse"}]
+
+    # Префиксные суммы весов: конкуренция в любом диапазоне — за O(1)
+    prefix = list(accumulate((1 + math.log1p(r) for _, r in pairs), initial=0.0))
+
+    lo_i = int(n * 0.02)
+    hi_i = max(lo_i, n - 1 - int(n * 0.02))
+    if sp[lo_i] == sp[hi_i]:
+        lo_i, hi_i = 0, n - 1
+
+    # Разрывы между соседними ценами
+    gaps = []
+    for i in range(lo_i, hi_i):
+        a, b = sp[i], sp[i + 1]
+        if b / a >= NICHE_MIN_GAP:
+            gaps.append((b / a, a, b))
+    gaps.sort(reverse=True)
+
+    # Корзины равной ширины в log-шкале либо равной наполненности (квантили)
+    lo, hi = sp[lo_i], sp[hi_i]
+    if mode == "quantile":
+        edges = [sp[lo_i + round(k * (hi_i - lo_i) / resolution)] for k in range(resolution + 1)]
+    else:
+        ratio = (hi / lo) ** (1 / resolution)
+        edges = [lo * ratio ** k for k in range(resolution)] + [hi]
+    edges = sorted(set(edges))
+
+    bins = []
+    for k in range(len(edges) - 1):
+        a, b = edges[k], edges[k + 1]
+        i = bisect_left(sp, a)
+        j = bisect_right(sp, b) if k == len(edges) - 2 else bisect_left(sp, b)
+        if j > i:
+            bins.append(((prefix[j] - prefix[i]) / math.log(b / a), j - i, a, b))
+    max_density = max((d for d, *_ in bins), default=0) or 1
+
+    niches = [{
+        "range":             f"{a:.0f}–{b:.0f}",
+        "count":             0,
+        "competition_pct":   0,
+        "recommended_price": round(math.sqrt(a * b), 2),
+        "lo":                round(a, 2),
+        "hi":                round(b, 2),
+        "kind":              "gap",
+        "gap_ratio":         round(r, 2),
+    } for r, a, b in gaps[:max(1, top // 2)]]
+
+    for density, count, a, b in sorted(bins)[:top - len(niches)]:
+        i, j = bisect_left(sp, a), bisect_right(sp, b)
+        niches.append({
+            "range":             f"{a:.0f}–{b:.0f}",
+            "count":             count,
+            "competition_pct":   round(density / max_density * 100),
+            "recommended_price": round(sp[(i + j - 1) // 2], 2),
+            "lo":                round(a, 2),
+            "hi":                round(b, 2),
+            "kind":              "sparse",
+        })
+    return niches
+
+
+def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_reviews: int = 500,
+                   budget: Optional[float] = None) -> dict:
     """
     Полный анализ продавца:
     - Базовый профиль (имя, рейтинг, кол-во отзывов)
@@ -416,6 +1026,8 @@ def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_re
     - Топ продаваемых товаров
     - Распределение звёзд в отзывах
     - Последние отзывы покупателей
+    С budget (секунды) отзывы грузятся, пока есть время; если собрать нужное
+    количество не успели, результат помечается partial=True.
     """
     if target.isdigit():
         user_id = int(target)
@@ -426,12 +1038,19 @@ def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_re
         else:
             return {"error": "Неверная ссылка на продавца", "type": "seller"}
 
-    profile = get_seller_profile(user_id, currency=currency)
+    deadline = time.monotonic() + budget if budget else None
+    lap = profiling.laps()
+    profile = get_seller_profile(user_id, currency=currency, deadline=deadline)
+    lap("profile")
     if not profile:
-        return {"error": "Не удалось получить данные продавца", "type": "seller"}
+        return _failure_result("Не удалось получить данные продавца", type="seller")
 
     # Загружаем отзывы с пагинацией
-    raw_reviews = get_seller_reviews_paginated(user_id, currency=currency, max_reviews=max_reviews)
+    raw_reviews = get_seller_reviews_paginated(user_id, currency=currency, max_reviews=max_reviews,
+                                               deadline=deadline)
+    lap("reviews")
+    # Сколько отзывов собрали бы без ограничения по времени
+    reviews_target = min(max_reviews, profile.get("total_reviews") or max_reviews)
 
     items_sold = []
     dates_sold = []          # список строк "Мес ГГГГ"
@@ -440,32 +1059,26 @@ def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_re
 
     for rev in raw_reviews:
         # Описание лота из отзыва
-        desc = rev.select_one(".review-item-detail, .review-item-desc, .review-item-title")
-        if desc:
-            items_sold.append(desc.get_text(strip=True))
+        if rev["item"] is not None:
+            items_sold.append(rev["item"])
 
         # Дата → нормализуем в месяц
-        date_el = rev.select_one(".review-item-date")
-        if date_el:
-            month_str = _parse_funpay_date_to_month(date_el.get_text(strip=True))
-            dates_sold.append(month_str)
+        if rev["date"] is not None:
+            dates_sold.append(_parse_funpay_date_to_month(rev["date"]))
 
         # Звёзды
-        stars = _parse_review_stars(rev)
+        stars = rev["stars"]
         if stars in star_counts:
             star_counts[stars] += 1
 
         # Текст отзыва покупателя
-        text_el = rev.select_one(".review-item-text")
-        if text_el and len(review_texts) < 20:
-            text = text_el.get_text(strip=True)
-            if text:
-                review_texts.append({
-                    "text":  text,
-                    "stars": stars,
-                    "date":  date_el.get_text(strip=True) if date_el else "",
-                    "item":  desc.get_text(strip=True) if desc else "",
-                })
+        if rev["text"] and len(review_texts) < 20:
+            review_texts.append({
+                "text":  rev["text"],
+                "stars": stars,
+                "date":  rev["date"] or "",
+                "item":  rev["item"] or "",
+            })
 
     # Топ продаваемых товаров
     top_items = []
@@ -484,6 +1097,7 @@ def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_re
 
     # Убираем нулевые звёзды из статистики (неопределённые)
     rating_dist = [{"stars": k, "count": v} for k, v in star_counts.items() if k > 0]
+    lap("aggregate")
 
     return {
         "type":           "seller",
@@ -499,4 +1113,6 @@ def analyze_seller(target: str, currency: str = "RUB", deep: bool = True, max_re
         "rating_dist":    rating_dist,
         "review_texts":   review_texts,
         "reviews_parsed": len(raw_reviews),
+        "partial":        _expired(deadline) and len(raw_reviews) < reviews_target,
+        "coverage":       {"reviews_parsed": len(raw_reviews), "reviews_target": reviews_target},
     }
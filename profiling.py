@@ -0,0 +1,129 @@
+"""
+FunPay Analytics — профилирование анализов
+Разбивка времени по этапам анализа и по каждому запросу к FunPay
+(очередь, вежливая задержка, соединение, загрузка, парсинг).
+Сбор включается только для конкретного запроса — в остальное время это no-op.
+"""
+import os
+import io
+import time
+import pstats
+import cProfile
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("FunPayAnalyst")
+
+PROFILE_DIR = os.environ.get("FUNPAY_PROFILE_DIR", "profiles")
+# Глубокий профиль (?profile=cprofile|pyinstrument) пишет файлы на сервер — по умолчанию выключен
+DEEP_ENABLED = os.environ.get("FUNPAY_DEEP_PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_KEEP = int(os.environ.get("FUNPAY_PROFILE_KEEP", "20"))  # столько последних отчётов хранится
+
+_current: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("funpay_profile", default=None)
+
+
+def active() -> bool:
+    return _current.get() is not None
+
+
+@contextmanager
+def collect():
+    """Включает сбор таймингов для текущего контекста; отдаёт словарь с результатом."""
+    data = {"stages": {}, "fetches": [], "started": time.perf_counter()}
+    token = _current.set(data)
+    try:
+        yield data
+    finally:
+        _current.reset(token)
+
+
+def laps():
+    """
+    Секундомер этапов: каждый вызов lap("имя") записывает время с предыдущего вызова.
+    Если профиль не собирается, возвращает пустышку.
+    """
+    data = _current.get()
+    if data is None:
+        return lambda name: None
+    last = [time.perf_counter()]
+
+    def lap(name: str) -> None:
+        now = time.perf_counter()
+        data["stages"][name] = data["stages"].get(name, 0.0) + now - last[0]
+        last[0] = now
+    return lap
+
+
+def record_fetch(url: str, **timings) -> None:
+    """Добавляет тайминги одного запроса к FunPay (секунды)."""
+    data = _current.get()
+    if data is not None:
+        data["fetches"].append({"url": url, **timings})
+
+
+def summary(data: dict) -> dict:
+    """Сводка для ответа API: этапы, суммы по фазам запросов и сами запросы, в миллисекундах."""
+    ms = lambda v: round(v * 1000, 1)
+    phases = ("queue_wait", "sleep", "connect", "transfer", "parse")
+    totals = {p: ms(sum(f.get(p, 0.0) for f in data["fetches"])) for p in phases}
+    return {
+        "total_ms":  ms(time.perf_counter() - data["started"]),
+        "stages_ms": {k: ms(v) for k, v in data["stages"].items()},
+        "fetch_totals_ms": totals,
+        "fetches": [{k: (ms(v) if k in phases else v) for k, v in f.items()} for f in data["fetches"]],
+    }
+
+
+def run_deep(kind: str, func, *args, **kwargs):
+    """
+    Разовый глубокий профиль: kind = 'cprofile' или 'pyinstrument' (если установлен).
+    Отчёт сохраняется в PROFILE_DIR (хранятся последние PROFILE_KEEP). Возвращает
+    (результат, сведения об отчёте: вид, имя файла и для cProfile — топ функций).
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 1_000_000:06d}"
+
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("[Profile] pyinstrument не установлен, используем cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"analysis-{stamp}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            _rotate()
+            return result, {"kind": "pyinstrument", "file": os.path.basename(path)}
+
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    path = os.path.join(PROFILE_DIR, f"analysis-{stamp}.prof")
+    profiler.dump_stats(path)
+    _rotate()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+    return result, {"kind": "cprofile", "file": os.path.basename(path), "top": out.getvalue()}
+
+
+def _rotate() -> None:
+    """Удаляет старые отчёты сверх PROFILE_KEEP."""
+    try:
+        reports = sorted(
+            (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.startswith("analysis-")),
+            key=os.path.getmtime,
+        )
+    except OSError:
+        return
+    for path in reports[:max(0, len(reports) - PROFILE_KEEP)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,131 @@
+"""
+FunPay Analytics — курсы валют FunPay
+Вместо отдельного скрейпа на каждую валюту категория обходится один раз в BASE_CURRENCY,
+а цены в остальных валютах выводятся по курсам. Курсы берутся с самого FunPay: опорная
+категория периодически загружается во всех валютах, и курс — медиана отношений цен
+одних и тех же лотов.
+"""
+import os
+import time
+import logging
+import threading
+from statistics import median
+from typing import Optional
+
+import parser
+
+logger = logging.getLogger("FunPayAnalyst")
+
+BASE_CURRENCY = "RUB"
+CURRENCIES = ("USD", "EUR", "UAH")
+SYMBOLS = {"RUB": "₽", "USD": "$", "EUR": "€", "UAH": "₴"}
+REFERENCE_URL = os.environ.get("FUNPAY_RATES_REFERENCE", f"{parser.BASE_URL}/lots/610/")
+REFRESH_INTERVAL = 3600   # как часто пересэмплировать курсы, секунды
+MAX_AGE = 6 * 3600        # более старым курсам не доверяем — валюта скрейпится напрямую
+MIN_SAMPLES = 10          # минимум совпавших лотов для курса
+
+_rates: dict[str, dict] = {}
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def _page_prices(currency: str) -> dict[str, float]:
+    """Цены лотов первой страницы опорной категории в валюте currency (ключ — ссылка на лот)."""
+    page = parser._fetch_extract(REFERENCE_URL, parser._extract_category_page, currency=currency)
+    if not page:
+        return {}
+    return {lot["url"]: lot["price"] for lot in page["lots"] if lot["price"] > 0}
+
+
+def refresh() -> dict[str, dict]:
+    """Пересчитывает курсы BASE_CURRENCY → CURRENCIES; валюты, где не набралось лотов, не трогает."""
+    base = _page_prices(BASE_CURRENCY)
+    if not base:
+        logger.warning("[Rates] Не удалось загрузить опорную категорию")
+        return get_all()
+    for currency in CURRENCIES:
+        prices = _page_prices(currency)
+        ratios = [prices[url] / p for url, p in base.items() if url in prices]
+        if len(ratios) < MIN_SAMPLES:
+            logger.warning(f"[Rates] {currency}: совпало {len(ratios)} лотов, курс не обновлён")
+            continue
+        with _lock:
+            _rates[currency] = {"rate": median(ratios), "samples": len(ratios), "ts": time.time()}
+        logger.info(f"[Rates] {BASE_CURRENCY}→{currency}: {median(ratios):.6f} по {len(ratios)} лотам")
+    return get_all()
+
+
+def get(currency: str) -> Optional[dict]:
+    """Свежий курс BASE_CURRENCY → currency ({"rate", "samples", "ts"}) или None."""
+    with _lock:
+        entry = _rates.get(currency)
+    if entry and time.time() - entry["ts"] < MAX_AGE:
+        return dict(entry)
+    return None
+
+
+def get_all() -> dict[str, dict]:
+    with _lock:
+        return {cur: dict(entry) for cur, entry in _rates.items()}
+
+
+def _convert_price(price: float, rate: float) -> float:
+    return round(price * rate, 2)
+
+
+def convert(result: dict, currency: str, entry: dict) -> dict:
+    """
+    Пересчитывает результат анализа из BASE_CURRENCY в currency.
+    Категория пересобирается из пересчитанных лотов — так корзины, ниши и подписи диапазонов
+    получаются такими же, как у прямого скрейпа. Результат помечается полем converted.
+    """
+    rate = entry["rate"]
+    if result.get("type") == "seller":
+        converted = dict(result)
+        converted["lots"] = [{
+            **lot,
+            "price":      _convert_price(lot["price"], rate),
+            "price_text": f"{_convert_price(lot['price'], rate):g} {SYMBOLS[currency]}",
+        } for lot in result.get("lots", [])]
+    else:
+        lots = [{k: v for k, v in lot.items() if k not in ("cluster_id", "outlier")}
+                | {"price": _convert_price(lot["price"], rate)}
+                for lot in result["all_lots"]]
+        converted = parser._summarize_category(lots, partial=result.get("partial", False),
+                                               coverage=result.get("coverage"))
+    converted["converted"] = note(currency, entry)
+    return converted
+
+
+def note(currency: str, entry: dict) -> dict:
+    """Поле converted: откуда, куда, по какому курсу и насколько он свежий."""
+    return {
+        "from":     BASE_CURRENCY,
+        "to":       currency,
+        "rate":     round(entry["rate"], 6),
+        "rate_age": round(time.time() - entry["ts"]),
+    }
+
+
+def convert_prices(items: list[dict], fields: tuple[str, ...], rate: float) -> list[dict]:
+    """Копии items, в которых поля-цены fields пересчитаны из BASE_CURRENCY (None не трогается)."""
+    return [{**item, **{f: _convert_price(item[f], rate) for f in fields if item.get(f) is not None}}
+            for item in items]
+
+
+def _loop() -> None:
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            logger.error(f"[Rates] Ошибка обновления курсов: {e}")
+        time.sleep(REFRESH_INTERVAL)
+
+
+def start() -> None:
+    """Запускает фоновое обновление курсов."""
+    global _thread
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_loop, name="rates", daemon=True)
+    _thread.start()
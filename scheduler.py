@@ -0,0 +1,194 @@
+"""
+FunPay Analytics — справедливая очередь скрейпов
+Скрейпы из /api/analyze выполняются не более чем в SLOTS потоках одновременно. Место
+в очереди определяет взвешенная справедливая очередь (WFQ): задаче присваивается
+виртуальное время окончания start + cost / weight, где start — позже из текущего
+виртуального времени и окончания предыдущей задачи того же клиента. Поэтому дешёвые
+задачи (категория — пара страниц) идут раньше глубоких обходов (продавец на 1000
+отзывов), а клиент, засыпающий очередь, обгоняет только сам себя.
+Квота клиента — ведро на QUOTA_PER_MINUTE единиц стоимости в минуту. Сверх квоты
+задача отклоняется (QUOTA_ACTION=reject) или ждёт, пока ведро наполнится (defer).
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger("FunPayAnalyst")
+
+SLOTS = int(os.environ.get("FUNPAY_SCHEDULER_SLOTS", os.environ.get("FUNPAY_MAX_FETCHES", "4")))
+QUOTA_PER_MINUTE = float(os.environ.get("FUNPAY_CLIENT_QUOTA", "120"))   # 0 — без квоты
+QUOTA_ACTION = os.environ.get("FUNPAY_QUOTA_ACTION", "reject")           # reject | defer
+MAX_QUEUED = int(os.environ.get("FUNPAY_CLIENT_MAX_QUEUED", "5"))        # задач одного клиента в очереди
+MAX_CLIENTS = 10_000  # столько клиентов помним, прежде чем забывать неактивных
+MAX_DEFER = 120.0  # дольше ждать квоту бессмысленно — клиент всё равно отвалится по таймауту
+
+
+def _parse_weights(raw: str) -> dict[str, float]:
+    """'client:3,10.0.0.5:2' → {"client": 3.0, "10.0.0.5": 2.0}."""
+    weights = {}
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        client, _, weight = part.rpartition(":")
+        try:
+            weights[client] = float(weight)
+        except ValueError:
+            logger.warning(f"[Scheduler] Неверный вес клиента: {part}")
+    return weights
+
+
+WEIGHTS = _parse_weights(os.environ.get("FUNPAY_CLIENT_WEIGHTS", ""))
+
+
+class Rejected(Exception):
+    """Задача не принята: клиент превысил квоту или лимит очереди."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Client:
+    def __init__(self, now: float):
+        self.tokens = QUOTA_PER_MINUTE
+        self.updated = now
+        self.last_finish = 0.0
+        self.queued = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(QUOTA_PER_MINUTE, self.tokens + (now - self.updated) * QUOTA_PER_MINUTE / 60)
+        self.updated = now
+
+
+_clients: dict[str, _Client] = {}
+_queue: list[dict] = []          # ожидающие задачи: {"tag", "seq", "not_before"}
+_running = 0
+_vtime = 0.0                     # виртуальное время: тег последней запущенной задачи
+_seq = 0
+_cond = threading.Condition()
+
+
+def _client(name: str, now: float) -> _Client:
+    """Состояние клиента (вызывать под _cond)."""
+    client = _clients.get(name)
+    if client is None:
+        if len(_clients) >= MAX_CLIENTS:
+            _forget_idle(now)
+        client = _clients[name] = _Client(now)
+    return client
+
+
+def _forget_idle(now: float) -> None:
+    """Забывает клиентов без задач в очереди и с полной квотой — их состояние ничего не меняет."""
+    for name, client in list(_clients.items()):
+        client.refill(now)
+        if not client.queued and client.tokens >= QUOTA_PER_MINUTE and client.last_finish <= _vtime:
+            del _clients[name]
+
+
+def _charge(client: _Client, cost: float, now: float) -> float:
+    """Списывает cost из квоты; возвращает, сколько секунд ждать наполнения (0 — сразу)."""
+    if not QUOTA_PER_MINUTE:
+        return 0.0
+    client.refill(now)
+    client.tokens -= cost
+    if client.tokens >= 0:
+        return 0.0
+    wait = -client.tokens * 60 / QUOTA_PER_MINUTE
+    if QUOTA_ACTION != "defer" or wait > MAX_DEFER:
+        client.tokens += cost  # отклонённая задача квоту не тратит
+        raise Rejected("quota", wait)
+    return wait
+
+
+def charge(name: str, cost: float) -> None:
+    """
+    Списывает квоту за весь запрос сразу — для запросов из нескольких задач (сравнения);
+    сами задачи затем встают в очередь через slot(..., prepaid=True).
+    Сверх квоты бросает Rejected или, в режиме defer, ждёт наполнения ведра.
+    """
+    with _cond:
+        now = time.monotonic()
+        try:
+            wait = _charge(_client(name, now), cost, now)
+        except Rejected:
+            metrics.SCHEDULER_REJECTED.inc(reason="quota")
+            raise
+    if wait:
+        time.sleep(wait)
+
+
+@contextmanager
+def slot(name: str, cost: float, prepaid: bool = False):
+    """
+    Ждёт очереди задачи клиента name стоимостью cost (примерно в страницах FunPay)
+    и держит место, пока выполняется тело with. Бросает Rejected при превышении квоты
+    или лимита очереди клиента. prepaid=True — квоту уже списал charge() за весь запрос,
+    и задача только встаёт в очередь (без проверки квоты и лимита очереди).
+    """
+    global _running, _vtime, _seq
+    started = time.monotonic()
+    with _cond:
+        client = _client(name, started)
+        if MAX_QUEUED and client.queued >= MAX_QUEUED and not prepaid:
+            metrics.SCHEDULER_REJECTED.inc(reason="queue")
+            raise Rejected("queue", 1.0)
+        try:
+            wait = 0.0 if prepaid else _charge(client, cost, started)
+        except Rejected:
+            metrics.SCHEDULER_REJECTED.inc(reason="quota")
+            raise
+        tag = max(_vtime, client.last_finish) + cost / WEIGHTS.get(name, 1.0)
+        client.last_finish = tag
+        _seq += 1
+        job = {"tag": tag, "seq": _seq, "not_before": started + wait}
+        _queue.append(job)
+        client.queued += 1
+        metrics.SCHEDULER_QUEUED.inc()
+        try:
+            while True:
+                now = time.monotonic()
+                eligible = [j for j in _queue if j["not_before"] <= now]
+                if _running < SLOTS and eligible and min(eligible, key=_order) is job:
+                    break
+                # Отложенные по квоте задачи просыпаются сами, остальные — по notify
+                timeouts = [j["not_before"] - now for j in _queue if j["not_before"] > now]
+                _cond.wait(min(timeouts) if timeouts else None)
+        finally:
+            _queue.remove(job)
+            client.queued -= 1
+            metrics.SCHEDULER_QUEUED.dec()
+            # Следующая по очереди задача может занять ещё свободное место
+            _cond.notify_all()
+        _running += 1
+        _vtime = max(_vtime, tag)
+    metrics.SCHEDULER_WAIT.observe(time.monotonic() - started)
+    try:
+        yield
+    finally:
+        with _cond:
+            _running -= 1
+            _cond.notify_all()
+
+
+def _order(job: dict) -> tuple[float, int]:
+    return job["tag"], job["seq"]
+
+
+def stats() -> dict:
+    """Состояние очереди для /api/scheduler."""
+    with _cond:
+        now = time.monotonic()
+        if QUOTA_PER_MINUTE:
+            for client in _clients.values():
+                client.refill(now)
+        return {
+            "slots":   SLOTS,
+            "running": _running,
+            "queued":  len(_queue),
+            "clients": {name: {"queued": c.queued, "quota_left": round(c.tokens, 1) if QUOTA_PER_MINUTE else None}
+                        for name, c in _clients.items()},
+        }
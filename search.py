@@ -0,0 +1,208 @@
+"""
+FunPay Analytics — полнотекстовый поиск по названиям лотов
+Инвертированный индекс (слова + триграммы) с ранжированием и фасетами по цене и продавцу.
+"""
+import re
+import math
+import heapq
+import logging
+import threading
+from collections import Counter
+from typing import Iterable, Optional
+
+from history import category_key, iter_current_lots, lot_key
+
+logger = logging.getLogger("FunPayAnalyst")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Документ = лот в конкретной валюте; ключ (currency, id оффера или url)
+_docs: dict[int, dict] = {}
+_doc_ids: dict[tuple[str, str], int] = {}
+_by_category: dict[tuple[str, str], set[int]] = {}
+_tokens: dict[str, dict[int, int]] = {}      # слово → {doc_id: tf}
+_trigrams: dict[str, set[int]] = {}          # триграмма → doc_ids
+_next_id = 0
+_lock = threading.RLock()
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _trigrams_of(token: str) -> set[str]:
+    if len(token) < 3:
+        return {token}
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _remove_doc(doc_id: int) -> None:
+    """Удаляет документ из всех списков (вызывать под _lock)."""
+    doc = _docs.pop(doc_id)
+    _doc_ids.pop((doc["currency"], doc["key"]), None)
+    for tok in set(doc["tokens"]):
+        postings = _tokens.get(tok)
+        if postings is not None:
+            postings.pop(doc_id, None)
+            if not postings:
+                del _tokens[tok]
+        for tri in _trigrams_of(tok):
+            ids = _trigrams.get(tri)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del _trigrams[tri]
+
+
+def _add_doc(lot: dict, category: str, currency: str) -> int:
+    """Добавляет (или заменяет) лот в индексе (вызывать под _lock)."""
+    global _next_id
+    key = lot_key(lot["url"])
+    old = _doc_ids.get((currency, key))
+    if old is not None:
+        _by_category.get((_docs[old]["category"], currency), set()).discard(old)
+        _remove_doc(old)
+
+    doc_id = _next_id
+    _next_id += 1
+    tokens = _tokenize(lot["title"])
+    _docs[doc_id] = {
+        "key":      key,
+        "title":    lot["title"],
+        "lower":    lot["title"].lower(),
+        "tokens":   tokens,
+        "price":    lot["price"],
+        "seller":   lot["seller"],
+        "online":   lot.get("online", False),
+        "url":      lot["url"],
+        "category": category,
+        "currency": currency,
+    }
+    _doc_ids[(currency, key)] = doc_id
+    for tok, tf in Counter(tokens).items():
+        _tokens.setdefault(tok, {})[doc_id] = tf
+        for tri in _trigrams_of(tok):
+            _trigrams.setdefault(tri, set()).add(doc_id)
+    return doc_id
+
+
+def index_category(category_url: str, currency: str, lots: Iterable[dict]) -> None:
+    """
+    Обновляет индекс результатами обхода категории:
+    лоты категории заменяются свежими, пропавшие удаляются.
+    """
+    cat = category_key(category_url)
+    with _lock:
+        stale = _by_category.get((cat, currency), set())
+        fresh = {_add_doc(lot, cat, currency) for lot in lots}
+        for doc_id in stale - fresh:
+            if doc_id in _docs:
+                _remove_doc(doc_id)
+        _by_category[(cat, currency)] = fresh
+
+
+def _term_matches(term: str) -> dict[int, float]:
+    """
+    Документы, содержащие слово запроса, с весом совпадения.
+    Точное слово весит 1.0, вхождение подстрокой (через триграммы) — 0.5.
+    """
+    n = len(_docs) or 1
+    matches: dict[int, float] = {}
+    exact = _tokens.get(term, {})
+    if exact:
+        idf = math.log(1 + n / len(exact))
+        for doc_id, tf in exact.items():
+            matches[doc_id] = idf * (1 + math.log(tf))
+
+    # Подстрока: пересечение списков триграмм, начиная с самого короткого
+    tris = sorted((_trigrams.get(t, set()) for t in _trigrams_of(term)), key=len)
+    if tris and tris[0]:
+        candidates = set(tris[0])
+        for ids in tris[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        if candidates:
+            idf = math.log(1 + n / len(candidates))
+            for doc_id in candidates:
+                if doc_id not in matches and term in _docs[doc_id]["lower"]:
+                    matches[doc_id] = idf * 0.5
+    return matches
+
+
+def search(query: str, currency: str = "RUB", category: Optional[str] = None, seller: Optional[str] = None,
+           min_price: Optional[float] = None, max_price: Optional[float] = None, limit: int = 50) -> dict:
+    """Ранжированный поиск лотов по названию (все слова запроса обязательны) с фасетами."""
+    terms = list(dict.fromkeys(_tokenize(query)))
+    cat = category_key(category) if category else None
+
+    with _lock:
+        if terms:
+            scores: Optional[dict[int, float]] = None
+            for term in terms:
+                matches = _term_matches(term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {d: s + matches[d] for d, s in scores.items() if d in matches}
+                if not scores:
+                    break
+            scores = scores or {}
+        else:
+            scores = {d: 0.0 for d in _docs}
+
+        hits = []
+        for doc_id, score in scores.items():
+            doc = _docs[doc_id]
+            if doc["currency"] != currency:
+                continue
+            if cat and doc["category"] != cat:
+                continue
+            if min_price is not None and doc["price"] < min_price:
+                continue
+            if max_price is not None and doc["price"] > max_price:
+                continue
+            hits.append((score, doc))
+        indexed = len(_docs)
+
+    # Фасет продавцов считаем до фильтра по продавцу, чтобы было видно альтернативы
+    seller_facet = Counter(doc["seller"] for _, doc in hits)
+    if seller:
+        hits = [(score, doc) for score, doc in hits if doc["seller"] == seller]
+
+    # Полная сортировка не нужна — берём только верх выдачи
+    top = heapq.nsmallest(limit, hits, key=lambda h: (-h[0], h[1]["price"]))
+    prices = sorted([doc["price"] for _, doc in hits if doc["price"] > 0])
+
+    return {
+        "query":   query,
+        "total":   len(hits),
+        "indexed": indexed,
+        "results": [{
+            "title":    doc["title"],
+            "price":    doc["price"],
+            "seller":   doc["seller"],
+            "online":   doc["online"],
+            "url":      doc["url"],
+            "category": doc["category"],
+            "score":    round(score, 3),
+        } for score, doc in top],
+        "facets": {
+            "sellers": [{"seller": s, "count": c} for s, c in seller_facet.most_common(10)],
+            "price": {
+                "min":    prices[0] if prices else 0,
+                "median": prices[len(prices) // 2] if prices else 0,
+                "max":    prices[-1] if prices else 0,
+            },
+        },
+    }
+
+
+def load_from_history() -> None:
+    """Наполняет индекс лотами, сохранёнными в истории (актуальный срез каждой категории)."""
+    grouped: dict[tuple[str, str], list[dict]] = {}
+    for lot in iter_current_lots():
+        grouped.setdefault((lot["category"], lot["currency"]), []).append(lot)
+    for (cat, currency), lots in grouped.items():
+        index_category(cat, currency, lots)
+    logger.info(f"[Search] Проиндексировано {len(_docs)} лотов из истории")
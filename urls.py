@@ -0,0 +1,89 @@
+"""
+FunPay Analytics — канонические ссылки FunPay
+Любая принятая форма ссылки на категорию, продавца или лот (http/https, www, /en/,
+со слэшем и без, с ?page=, голый номер категории) сводится к цели (kind, id),
+а кэш, single-flight и список наблюдения ключуются по (kind, id, currency).
+"""
+import os
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import urlparse, parse_qs
+
+# Адрес FunPay; для нагрузочных тестов его подменяют локальной заглушкой (bench/mock_funpay.py)
+BASE_URL = os.environ.get("FUNPAY_BASE_URL", "https://funpay.com").rstrip("/")
+
+# Виды целей: категории лотов и валюты, продавцы и отдельные лоты в обоих разделах
+KINDS = ("lots", "chips", "users", "lots_offer", "chips_offer")
+
+_HOSTS = {"funpay.com", "www.funpay.com", urlparse(BASE_URL).netloc}
+_PATH_RE = re.compile(r"^/(?:[a-z]{2}/)?(lots|chips|users)/(\d+)/?$")
+_OFFER_RE = re.compile(r"^/(?:[a-z]{2}/)?(lots|chips)/offer/?$")
+
+
+class Target(NamedTuple):
+    kind: str
+    id: str
+
+    @property
+    def url(self) -> str:
+        """Каноническая ссылка на цель."""
+        if self.kind.endswith("_offer"):
+            return f"{BASE_URL}/{self.kind[:-len('_offer')]}/offer?id={self.id}"
+        return f"{BASE_URL}/{self.kind}/{self.id}/"
+
+    @property
+    def is_seller(self) -> bool:
+        return self.kind == "users"
+
+    @property
+    def is_offer(self) -> bool:
+        return self.kind.endswith("_offer")
+
+    @property
+    def is_category(self) -> bool:
+        return self.kind in ("lots", "chips")
+
+
+class Key(NamedTuple):
+    kind: str
+    id: str
+    currency: str
+
+    def __str__(self) -> str:
+        return f"{self.kind}/{self.id}:{self.currency}"
+
+
+def parse(raw: str) -> Optional[Target]:
+    """Цель по ссылке в любой принятой форме или None, если это не ссылка FunPay."""
+    raw = raw.strip()
+    if raw.isdigit():
+        return Target("lots", raw)
+    if "://" not in raw:
+        # «funpay.com/lots/610/» — хост без схемы, «/lots/610/» и «lots/610» — путь
+        first = raw.lstrip("/").split("/", 1)[0]
+        raw = "https://" + raw if "." in first and not raw.startswith("/") else "https://funpay.com/" + raw.lstrip("/")
+    parsed = urlparse(raw)
+    if parsed.scheme not in ("http", "https") or parsed.netloc.lower() not in _HOSTS:
+        return None
+    m = _OFFER_RE.match(parsed.path)
+    if m:
+        offer_id = parse_qs(parsed.query).get("id", [""])[0]
+        return Target(f"{m.group(1)}_offer", offer_id) if re.fullmatch(r"[\w-]+", offer_id) else None
+    m = _PATH_RE.match(parsed.path)
+    if m:
+        return Target(m.group(1), m.group(2))
+    return None
+
+
+def canonical(raw: str) -> str:
+    """Каноническая ссылка; нераспознанная строка возвращается как есть (без пробелов по краям)."""
+    target = parse(raw)
+    return target.url if target else raw.strip()
+
+
+def key(raw: str, currency: str) -> Key:
+    """Ключ кэша для ссылки в валюте; нераспознанная ссылка ключуется сама собой."""
+    target = parse(raw)
+    if target is None:
+        return Key("raw", raw.strip(), currency)
+    return Key(target.kind, target.id, currency)
@@ -0,0 +1,192 @@
+"""
+FunPay Analytics — тёплый перезапуск кэша анализов
+Кэш результатов периодически и при остановке сохраняется в один файл: сжатые (zlib)
+pickle-записи подряд, за ними индекс и заголовок с его смещением. При запуске файл
+отображается в память (mmap) и читается только индекс, а запись распаковывается при
+первом обращении к ней — старт не зависит от размера кэша. Записи сохраняют свой
+возраст, так что после перезапуска живут ровно остаток CACHE_TTL.
+"""
+import os
+import mmap
+import zlib
+import time
+import atexit
+import pickle
+import struct
+import logging
+import threading
+from typing import Callable, Optional
+
+from urls import Key
+
+logger = logging.getLogger("FunPayAnalyst")
+
+CACHE_FILE = os.environ.get("FUNPAY_CACHE_FILE", "funpay_cache.bin")
+SNAPSHOT_INTERVAL = int(os.environ.get("FUNPAY_CACHE_SNAPSHOT_INTERVAL", "60"))
+
+_MAGIC = b"FPCACHE1"
+_FOOTER = struct.Struct("<QQ")  # смещение и длина индекса
+
+_map: Optional[mmap.mmap] = None
+_file = None
+# Все записи текущего файла: ключ → (ts, смещение, длина); по ним save переиспользует
+# сжатые записи, которые с прошлого снимка не менялись
+_stored: dict[Key, tuple[float, int, int]] = {}
+# Ещё не прочитанные записи файла (подмножество _stored)
+_index: dict[Key, tuple[float, int, int]] = {}
+_lock = threading.Lock()
+# Снимки пишутся по одному; только save и load закрывают _map, поэтому под _save_lock
+# старое отображение можно читать без _lock
+_save_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def _close() -> None:
+    """Закрывает отображение файла (вызывать под _lock)."""
+    global _map, _file
+    if _map is not None:
+        _map.close()
+        _file.close()
+    _map, _file = None, None
+
+
+def _open() -> dict[Key, tuple[float, int, int]]:
+    """Отображает CACHE_FILE в память и читает индекс (вызывать под _lock)."""
+    global _map, _file
+    _close()
+    _file = open(CACHE_FILE, "rb")
+    _map = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if _map[:len(_MAGIC)] != _MAGIC:
+        raise ValueError("неизвестный формат")
+    index_off, index_len = _FOOTER.unpack_from(_map, len(_map) - _FOOTER.size)
+    entries = pickle.loads(_map[index_off:index_off + index_len])
+    return {Key(kind, id_, currency): (ts, off, length) for kind, id_, currency, ts, off, length in entries}
+
+
+def load(ttl: float) -> int:
+    """Открывает снимок и читает его индекс; записи старше ttl пропускаются. Возвращает число записей."""
+    global _stored
+    if not os.path.exists(CACHE_FILE) or os.path.getsize(CACHE_FILE) < len(_MAGIC) + _FOOTER.size:
+        return 0
+    now = time.time()
+    with _save_lock, _lock:
+        try:
+            _stored = _open()
+        except (OSError, ValueError, pickle.UnpicklingError, struct.error) as e:
+            logger.error(f"[WarmCache] Не удалось прочитать {CACHE_FILE}: {e}")
+            _close()
+            _stored = {}
+            return 0
+        _index.clear()
+        _index.update((k, meta) for k, meta in _stored.items() if now - meta[0] < ttl)
+        count = len(_index)
+    logger.info(f"[WarmCache] В снимке {count} живых записей кэша")
+    return count
+
+
+def get(key: Key, ttl: float) -> Optional[dict]:
+    """Запись кэша {"data", "ts"} из снимка, если она там есть и не старше ttl. Каждая читается один раз."""
+    with _lock:
+        meta = _index.pop(key, None)
+        if meta is None or _map is None:
+            return None
+        ts, off, length = meta
+        if time.time() - ts >= ttl:
+            return None
+        blob = _map[off:off + length]
+    try:
+        return {"data": pickle.loads(zlib.decompress(blob)), "ts": ts}
+    except Exception as e:
+        logger.warning(f"[WarmCache] Повреждённая запись {key}: {e}")
+        return None
+
+
+def contains(key: Key, ttl: float) -> bool:
+    """Ждёт ли в снимке живая непрочитанная запись key (запись не расходуется)."""
+    with _lock:
+        meta = _index.get(key)
+    return meta is not None and time.time() - meta[0] < ttl
+
+
+def save(entries: dict, ttl: float) -> int:
+    """
+    Записывает снимок: живые записи entries (ключ → {"data", "ts"}) и ещё не прочитанные
+    записи прежнего снимка. Сжатие идёт без _lock, так что get() не ждёт записи файла;
+    записи, не менявшиеся с прошлого снимка, копируются из него без повторного сжатия.
+    Файл заменяется атомарно. Возвращает число записей.
+    """
+    global _stored
+    now = time.time()
+    tmp = CACHE_FILE + ".tmp"
+    with _save_lock:
+        with _lock:
+            pending = dict(_index)
+            stored = dict(_stored)
+            old_map = _map
+        index = []
+        reused = 0
+        try:
+            with open(tmp, "wb") as f:
+                f.write(_MAGIC)
+                for key, entry in entries.items():
+                    if now - entry["ts"] >= ttl:
+                        continue
+                    meta = stored.get(key)
+                    if meta is not None and meta[0] == entry["ts"] and old_map is not None:
+                        blob = old_map[meta[1]:meta[1] + meta[2]]
+                        reused += 1
+                    else:
+                        blob = zlib.compress(pickle.dumps(entry["data"], protocol=pickle.HIGHEST_PROTOCOL), 6)
+                    index.append((key.kind, key.id, key.currency, entry["ts"], f.tell(), len(blob)))
+                    f.write(blob)
+                # Непрочитанные записи переносятся как есть, без распаковки
+                for key, (ts, off, length) in pending.items():
+                    if key in entries or now - ts >= ttl or old_map is None:
+                        continue
+                    index.append((key.kind, key.id, key.currency, ts, f.tell(), length))
+                    f.write(old_map[off:off + length])
+                index_off = f.tell()
+                index_blob = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(index_blob)
+                f.write(_FOOTER.pack(index_off, len(index_blob)))
+        except OSError as e:
+            logger.error(f"[WarmCache] Не удалось записать {CACHE_FILE}: {e}")
+            return 0
+
+        with _lock:
+            # Отображение старого файла закрываем до замены (на Windows иначе не заменить)
+            _close()
+            try:
+                os.replace(tmp, CACHE_FILE)
+                _stored = _open()
+            except (OSError, ValueError, pickle.UnpicklingError, struct.error) as e:
+                logger.error(f"[WarmCache] Не удалось открыть новый снимок {CACHE_FILE}: {e}")
+                _close()
+                _stored = {}
+                _index.clear()
+                return 0
+            # Непрочитанными остаются записи, которых за время записи не коснулся get()
+            unread = {k: _stored[k] for k in _index if k in _stored and k not in entries}
+            _index.clear()
+            _index.update(unread)
+    logger.info(f"[WarmCache] Сохранено {len(index)} записей кэша (без пересжатия {reused})")
+    return len(index)
+
+
+def _loop(snapshot: Callable[[], None]) -> None:
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            snapshot()
+        except Exception as e:
+            logger.error(f"[WarmCache] Ошибка сохранения кэша: {e}")
+
+
+def start(snapshot: Callable[[], None]) -> None:
+    """Запускает периодическое сохранение и сохранение при остановке процесса."""
+    global _thread
+    if _thread is not None:
+        return
+    atexit.register(snapshot)
+    _thread = threading.Thread(target=_loop, args=(snapshot,), name="warmcache", daemon=True)
+    _thread.start()
@@ -0,0 +1,176 @@
+"""
+FunPay Analytics — список наблюдения
+Фоновый планировщик, который заранее обновляет популярные категории и продавцов,
+чтобы запросы пользователей к ним всегда попадали в кэш.
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import urls
+
+logger = logging.getLogger("FunPayAnalyst")
+
+WATCHLIST_PATH = os.environ.get("FUNPAY_WATCHLIST", "watchlist.json")
+DEFAULT_INTERVAL = 240  # чуть меньше TTL кэша, чтобы запись не успевала протухнуть
+MIN_INTERVAL = 60
+
+_entries: dict[str, dict] = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _key(url: str, currency: str) -> str:
+    # Канонический ключ: /en/-ссылки, http и номер категории сводятся к одной записи
+    return str(urls.key(url, currency))
+
+
+def _save() -> None:
+    """Сохраняет список на диск (вызывать под _lock)."""
+    tmp = WATCHLIST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(list(_entries.values()), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, WATCHLIST_PATH)
+
+
+def load() -> None:
+    """Читает список наблюдения с диска."""
+    if not os.path.exists(WATCHLIST_PATH):
+        return
+    try:
+        with open(WATCHLIST_PATH, encoding="utf-8") as f:
+            items = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"[Watchlist] Не удалось прочитать {WATCHLIST_PATH}: {e}")
+        return
+    if not isinstance(items, list):
+        logger.error(f"[Watchlist] {WATCHLIST_PATH}: ожидался список целей")
+        return
+    loaded = 0
+    with _lock:
+        for item in items:
+            if not (isinstance(item, dict) and isinstance(item.get("url"), str)
+                    and isinstance(item.get("currency"), str)):
+                logger.warning(f"[Watchlist] Пропущена повреждённая запись: {item!r}")
+                continue
+            target = urls.parse(item["url"])
+            if target is None:
+                # Старые версии принимали любые ссылки — не-FunPay цели не обходим
+                logger.warning(f"[Watchlist] Пропущена цель не с FunPay: {item['url']}")
+                continue
+            item["url"] = target.url
+            # Недостающие поля планировщика — как у только что добавленной цели
+            item.setdefault("hits", 0)
+            item.setdefault("last_run", 0)
+            item.setdefault("last_ok", None)
+            item.setdefault("interval", DEFAULT_INTERVAL)
+            _entries[_key(item["url"], item["currency"])] = item
+            loaded += 1
+    logger.info(f"[Watchlist] Загружено {loaded} целей")
+
+
+def add(url: str, currency: str = "RUB", interval: int = DEFAULT_INTERVAL, max_reviews: int = 200) -> dict:
+    """Добавляет (или обновляет) цель наблюдения."""
+    key = _key(url, currency)
+    with _lock:
+        entry = _entries.get(key) or {
+            "url":      url,
+            "currency": currency,
+            "hits":     0,
+            "last_run": 0,
+            "last_ok":  None,
+        }
+        entry["interval"] = max(MIN_INTERVAL, int(interval))
+        entry["max_reviews"] = max_reviews
+        _entries[key] = entry
+        _save()
+    _wakeup.set()
+    return dict(entry)
+
+
+def remove(url: str, currency: str = "RUB") -> bool:
+    with _lock:
+        removed = _entries.pop(_key(url, currency), None) is not None
+        if removed:
+            _save()
+    return removed
+
+
+def list_entries() -> list[dict]:
+    now = time.time()
+    with _lock:
+        return [{**e, "next_run_in": max(0, round(e["last_run"] + e["interval"] - now))}
+                for e in _entries.values()]
+
+
+def record_hit(url: str, currency: str) -> None:
+    """Учитывает обращение пользователя к цели — влияет на приоритет обновления."""
+    with _lock:
+        entry = _entries.get(_key(url, currency))
+        if entry:
+            entry["hits"] += 1
+
+
+def _score(entry: dict, now: float) -> float:
+    """Приоритет: насколько запись просрочена, с поправкой на популярность."""
+    staleness = (now - entry["last_run"]) / entry["interval"]
+    return staleness * (1 + math.log1p(entry["hits"]))
+
+
+def _pick_next(now: float) -> tuple[Optional[dict], float]:
+    """Возвращает самую приоритетную просроченную цель и время до следующей."""
+    with _lock:
+        due = [e for e in _entries.values() if now - e["last_run"] >= e["interval"]]
+        if due:
+            return max(due, key=lambda e: _score(e, now)), 0
+        if not _entries:
+            return None, DEFAULT_INTERVAL
+        wait = min(e["last_run"] + e["interval"] - now for e in _entries.values())
+        return None, max(1.0, wait)
+
+
+def _loop(runner: Callable[[str, str, int], dict]) -> None:
+    while True:
+        entry, wait = _pick_next(time.time())
+        if entry is None:
+            _wakeup.wait(wait)
+            _wakeup.clear()
+            continue
+
+        # Задачи выполняются по одной: фон занимает не больше одного слота
+        # из общего бюджета запросов, остальные остаются пользователям
+        started = time.time()
+        try:
+            result = runner(entry["url"], entry["currency"], entry.get("max_reviews", 200))
+            ok = "error" not in result
+        except Exception as e:
+            logger.error(f"[Watchlist] Ошибка обновления {entry['url']}: {e}")
+            ok = False
+        with _lock:
+            entry["last_run"] = started
+            entry["last_ok"] = ok
+            try:
+                _save()
+            except Exception as e:
+                # Список в памяти актуален, запишется при следующем обновлении;
+                # падение здесь остановило бы весь фоновый прогрев
+                logger.error(f"[Watchlist] Не удалось сохранить {WATCHLIST_PATH}: {e}")
+        logger.info(f"[Watchlist] {entry['url']} ({entry['currency']}) обновлён за {time.time() - started:.1f}с")
+
+
+def start(runner: Callable[[str, str, int], dict]) -> None:
+    """
+    Запускает фоновый поток планировщика.
+    runner(url, currency, max_reviews) должен выполнить анализ и записать его в кэш.
+    """
+    global _thread
+    if _thread is not None:
+        return
+    load()
+    _thread = threading.Thread(target=_loop, args=(runner,), name="watchlist", daemon=True)
+    _thread.start()